@@ -0,0 +1,73 @@
+"""
+Query results as pyarrow Tables, from DuckDB to the screen.
+
+st.dataframe and the charts take Arrow tables directly, so pages never build
+pandas DataFrames. String columns are dictionary-encoded, which stores each
+repeated state, category or city once, and filtering or selecting columns
+slices the cached table instead of copying it.
+"""
+import duckdb
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# In-memory database that rolls cached results up (see queries.QueryTemplate.rollup)
+_local = duckdb.connect()
+
+
+def fetch(conn, sql, params=None):
+    return _encode(conn.execute(sql, params or None).to_arrow_table())
+
+
+def rollup(table, sql):
+    """Run sql over table, which it reads as ``cube``, without leaving the process."""
+    with _local.cursor() as cursor:
+        cursor.register("cube", table)
+        return fetch(cursor, sql)
+
+
+def _encode(table):
+    for i, column in enumerate(table.schema):
+        if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+            table = table.set_column(i, column.name, pc.dictionary_encode(table.column(i)))
+        elif pa.types.is_decimal(column.type):
+            # DuckDB hands SUM(BIGINT) over as DECIMAL(38, 0); charts want plain numbers
+            table = table.set_column(i, column.name, table.column(i).cast(pa.float64()))
+    return table
+
+
+def decode(table):
+    """Table with dictionary columns turned back into plain values (for CSV)."""
+    for i, column in enumerate(table.schema):
+        if pa.types.is_dictionary(column.type):
+            table = table.set_column(i, column.name, table.column(i).cast(column.type.value_type))
+    return table
+
+
+def where(table, column, values):
+    """Rows whose column is one of values."""
+    data = table[column]
+    if pa.types.is_dictionary(data.type):
+        data = data.cast(data.type.value_type)
+    return table.filter(pc.is_in(data, value_set=pa.array(list(values), type=data.type)))
+
+
+def grain(table, level, columns):
+    """Rows of a GROUPING SETS result at one grain, limited to columns."""
+    return table.filter(pc.equal(table["grain"], level)).select(columns)
+
+
+def drop(table, columns):
+    return table.select([name for name in table.column_names if name not in columns])
+
+
+def total(table, column):
+    return pc.sum(table[column]).as_py() or 0
+
+
+def distinct(table, column):
+    return sorted(value for value in pc.unique(table[column]).to_pylist() if value is not None)
+
+
+def last_row(table):
+    """The final row as a dict of Python values."""
+    return table.slice(table.num_rows - 1).to_pylist()[0]
@@ -0,0 +1,120 @@
+"""
+Where the dashboard's tables live.
+
+Every backend hands out a DuckDB connection exposing the same table names
+(tmsis_claims, hiv_claims_rollup, provider_dim, state_year_summary,
+dataset_metadata, hiv_hcpcs_reference, npi_lookup), so queries.py runs unchanged on each:
+
+    motherduck  the production warehouse (md:my_db)
+    duckdb      a local .duckdb file built with build_tables.py
+    parquet     a state/year-partitioned Parquet export (parquet_dataset.py)
+    synthetic   generated in memory (synthetic_data.py); no network or secrets
+
+Pick one with the TMSIS_BACKEND environment variable; see from_env().
+"""
+import os
+from abc import ABC, abstractmethod
+
+import duckdb
+
+import build_tables
+import dataset_metadata
+import synthetic_data
+from parquet_dataset import ParquetDataset
+
+
+class Backend(ABC):
+    name = None
+    # Sidebar metadata snapshot describing this backend's data, if any
+    metadata_snapshot = None
+    # Queries cross the network, so HIV pages are worth a local working set
+    remote = False
+
+    @abstractmethod
+    def connect(self):
+        """A DuckDB connection exposing the dashboard's tables."""
+
+    def table_source(self, table, params):
+        """SQL to read a queries.TABLE_SLOTS table from; see queries.render()."""
+        return table
+
+
+class MotherDuckBackend(Backend):
+    name = "motherduck"
+    metadata_snapshot = dataset_metadata.SNAPSHOT_PATH
+    remote = True
+
+    def __init__(self, database="md:my_db", token=None):
+        self.database = database
+        # token may be a callable so secrets are only read when connecting
+        self.token = token
+
+    def connect(self):
+        token = self.token() if callable(self.token) else self.token
+        if token:
+            return duckdb.connect(f"{self.database}?motherduck_token={token}")
+        return duckdb.connect(self.database)
+
+
+class DuckDBFileBackend(Backend):
+    name = "duckdb"
+
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self):
+        return duckdb.connect(self.path, read_only=True)
+
+
+class ParquetBackend(Backend):
+    name = "parquet"
+
+    def __init__(self, root):
+        self.dataset = ParquetDataset(root)
+
+    def connect(self):
+        return self.dataset.connect()
+
+    def table_source(self, table, params):
+        return self.dataset.scan(table, params)
+
+
+class SyntheticBackend(Backend):
+    name = "synthetic"
+
+    def __init__(self, rows=200_000, seed=0):
+        self.rows = rows
+        self.seed = seed
+
+    def connect(self):
+        conn = duckdb.connect()
+        synthetic_data.generate(conn, rows=self.rows, seed=self.seed)
+        build_tables.build_all(conn, log=None)
+        return conn
+
+
+def from_env(motherduck_token=None, environ=None):
+    """
+    Build the backend named by TMSIS_BACKEND (default motherduck, or parquet
+    when only TMSIS_PARQUET_ROOT is set).
+
+    TMSIS_DATABASE        MotherDuck database or local .duckdb path
+    TMSIS_PARQUET_ROOT    Parquet export root
+    TMSIS_SYNTHETIC_ROWS  synthetic claim rows (default 200000)
+    TMSIS_SYNTHETIC_SEED  synthetic data seed (default 0)
+    """
+    env = os.environ if environ is None else environ
+    kind = env.get("TMSIS_BACKEND") or ("parquet" if env.get("TMSIS_PARQUET_ROOT") else "motherduck")
+
+    if kind == "motherduck":
+        return MotherDuckBackend(env.get("TMSIS_DATABASE", "md:my_db"), token=env.get("MOTHERDUCK_TOKEN") or motherduck_token)
+    if kind == "duckdb":
+        return DuckDBFileBackend(env.get("TMSIS_DATABASE", "tmsis.duckdb"))
+    if kind == "parquet":
+        return ParquetBackend(env["TMSIS_PARQUET_ROOT"])
+    if kind == "synthetic":
+        return SyntheticBackend(
+            rows=int(env.get("TMSIS_SYNTHETIC_ROWS", 200_000)),
+            seed=int(env.get("TMSIS_SYNTHETIC_SEED", 0)),
+        )
+    raise ValueError(f"Unknown TMSIS_BACKEND '{kind}' (expected motherduck, duckdb, parquet or synthetic)")
@@ -0,0 +1,223 @@
+"""
+Replay every dashboard query against a synthetic local database and record
+latency, rows/bytes scanned and memory as JSON.
+
+Usage (from the repo root):
+    python -m bench.benchmark --rows 1000000
+    python -m bench.benchmark --rows 50000000 --repeat 10 --compare bench/results/<old>.json
+
+The database is generated once per scale with synthetic_data.py and built
+with build_tables.py, then reused (pass --rebuild to regenerate). Each query
+runs once to warm up and --repeat more times with DuckDB's JSON profiler on.
+Results go to bench/results/<commit>-<rows>.json; --compare prints the p95
+change per template against an earlier result file.
+"""
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from itertools import product
+from pathlib import Path
+
+import duckdb
+
+import build_tables
+import queries
+import synthetic_data
+
+BENCH_DIR = Path(__file__).parent
+
+# Largest state, a small one and a multi-state selection, plus "all"
+STATE_GRID = [[], ["CA"], ["VT"], ["CA", "NY", "TX"]]
+YEAR_GRID = [[], [2024], [2022, 2023, 2024]]
+
+# What each page issues; directory views are measured as their first page
+PAGE_TEMPLATES = ["state_overview", "hiv_services", "trends"]
+DIRECTORY_TEMPLATES = ["directory_billing", "directory_servicing", "directory_combined"]
+DIRECTORY_PAGE_SIZE = 100
+
+# Profiler metrics recorded when the DuckDB version reports them
+PROFILE_METRICS = {
+    "rows_scanned": "cumulative_rows_scanned",
+    "bytes_read": "total_bytes_read",
+    "peak_buffer_bytes": "system_peak_buffer_memory",
+    "cpu_time_s": "cpu_time",
+}
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+
+def _latency_summary(latencies):
+    return {
+        "p50_ms": _percentile(latencies, 0.50),
+        "p95_ms": _percentile(latencies, 0.95),
+        "p99_ms": _percentile(latencies, 0.99),
+        "max_ms": max(latencies) if latencies else None,
+    }
+
+
+def _peak_rss_mb():
+    # ru_maxrss is KB on Linux and bytes on macOS. It is the peak over the
+    # process lifetime, so it is reported once per run, not per case.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2**20 if platform.system() == "Darwin" else 2**10), 1)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, cwd=BENCH_DIR
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def build_database(path, rows, seed, rebuild=False):
+    """Generate and build the synthetic database at path unless it already exists."""
+    path = Path(path)
+    if path.exists() and not rebuild:
+        return
+    # Built under a temporary name and renamed when complete, so a crashed
+    # build never leaves a partial database for later runs to reuse
+    partial = path.with_name(path.name + ".partial")
+    partial.unlink(missing_ok=True)
+    try:
+        conn = duckdb.connect(str(partial))
+        try:
+            start = time.perf_counter()
+            synthetic_data.generate(conn, rows=rows, seed=seed)
+            print(f"synthetic data: {rows:,} rows in {time.perf_counter() - start:.1f}s")
+            build_tables.build_all(conn)
+        finally:
+            conn.close()
+        partial.replace(path)
+    finally:
+        partial.unlink(missing_ok=True)
+        Path(str(partial) + ".wal").unlink(missing_ok=True)
+
+
+def cases():
+    """(label, template_id, sql, params) for every page query over the state x year grid."""
+    yield "hcpcs_reference", "hcpcs_reference", *queries.render("hcpcs_reference", {})
+    for states, years in product(STATE_GRID, YEAR_GRID):
+        filters = {"states": states, "years": years}
+        for template_id in PAGE_TEMPLATES:
+            yield template_id, template_id, *queries.render(template_id, filters)
+        for template_id in DIRECTORY_TEMPLATES:
+            yield template_id, template_id, *queries.render_page(template_id, filters, limit=DIRECTORY_PAGE_SIZE)
+
+
+def _profile(conn, profile_path, sql, params):
+    start = time.perf_counter()
+    table = conn.execute(sql, params or None).to_arrow_table()
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    try:
+        profile = json.loads(Path(profile_path).read_text())
+    except (OSError, ValueError):
+        profile = {}
+    metrics = {name: profile[key] for name, key in PROFILE_METRICS.items() if key in profile}
+    return elapsed_ms, table.num_rows, metrics
+
+
+def run(database, repeat=5, threads=None):
+    conn = duckdb.connect(str(database), read_only=True)
+    if threads:
+        conn.execute(f"SET threads = {int(threads)}")
+    profile_path = Path(tempfile.mkdtemp(prefix="tmsis-bench-")) / "profile.json"
+    conn.execute("PRAGMA enable_profiling = 'json'")
+    conn.execute(f"PRAGMA profiling_output = '{profile_path}'")
+    try:
+        settings = {key.upper(): "true" for key in ["latency", *PROFILE_METRICS.values()]}
+        conn.execute(f"SET custom_profiling_settings = '{json.dumps(settings)}'")
+    except duckdb.Error:
+        pass  # older DuckDB: keep its default metrics
+
+    results = []
+    for label, template_id, sql, params in cases():
+        filters = dict(params)
+        _profile(conn, profile_path, sql, params)  # warm-up
+        latencies, metrics = [], {}
+        for _ in range(repeat):
+            elapsed_ms, rows, metrics = _profile(conn, profile_path, sql, params)
+            latencies.append(round(elapsed_ms, 2))
+        results.append({
+            "template": label,
+            "filters": filters,
+            "rows_returned": rows,
+            "latencies_ms": latencies,
+            **_latency_summary(latencies),
+            **metrics,
+        })
+        print(f"{label:22} {json.dumps(filters):60} p50 {results[-1]['p50_ms']:9.1f} ms")
+    conn.close()
+    return results
+
+
+def summarize(results):
+    by_template = {}
+    for case in results:
+        by_template.setdefault(case["template"], []).extend(case["latencies_ms"])
+    return {template: _latency_summary(latencies) for template, latencies in by_template.items()}
+
+
+def compare(current, baseline_path):
+    baseline = json.loads(Path(baseline_path).read_text())["templates"]
+    print(f"\np95 vs {baseline_path}")
+    for template, summary in current.items():
+        old = baseline.get(template, {}).get("p95_ms")
+        new = summary["p95_ms"]
+        change = f"{(new - old) / old:+.0%}" if old else "new"
+        print(f"  {template:22} {old or 0:9.1f} -> {new:9.1f} ms  {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dashboard queries on synthetic data.")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Synthetic tmsis_enriched rows (1M to 227M)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database", help="DuckDB file to build/reuse (default bench/data/tmsis_<rows>.duckdb)")
+    parser.add_argument("--rebuild", action="store_true", help="Regenerate the database even if it exists")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per query after one warm-up")
+    parser.add_argument("--threads", type=int, help="DuckDB threads (default: all cores)")
+    parser.add_argument("--output", help="Result JSON path (default bench/results/<commit>-<rows>.json)")
+    parser.add_argument("--compare", metavar="JSON", help="Earlier result file to compare p95 against")
+    args = parser.parse_args()
+
+    database = Path(args.database or BENCH_DIR / "data" / f"tmsis_{args.rows}.duckdb")
+    database.parent.mkdir(parents=True, exist_ok=True)
+    build_database(database, args.rows, args.seed, rebuild=args.rebuild)
+
+    results = run(database, repeat=args.repeat, threads=args.threads)
+    commit = _git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "run_at": datetime.now(timezone.utc).isoformat(),
+            "rows": args.rows,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "threads": args.threads,
+            "duckdb_version": duckdb.__version__,
+            "python": platform.python_version(),
+            "machine": platform.platform(),
+            "peak_rss_mb": _peak_rss_mb(),
+        },
+        "templates": summarize(results),
+        "cases": results,
+    }
+    output = Path(args.output or BENCH_DIR / "results" / f"{commit}-{args.rows}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2) + "\n")
+    print(f"\nresults: {output}")
+    if args.compare:
+        compare(report["templates"], args.compare)
+
+
+if __name__ == "__main__":
+    main()
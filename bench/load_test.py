@@ -0,0 +1,262 @@
+"""
+Concurrent-session load test driving the real streamlit_app.py.
+
+Each simulated user is a Streamlit AppTest session running on its own
+thread in this process, so, like a deployed server, every session shares
+the app's cached connection, query runner and result cache. Users click
+through pages, change the state filter and search the Provider Directory;
+each rerun is timed. For every concurrency level the report holds
+throughput, rerun latency percentiles, errors, the cache hit rate and
+queue wait (read back from the query log) and process RSS. A level with
+any session error aborts the run with the first traceback, and no report
+is written.
+
+Usage (from the repo root):
+    python -m bench.load_test --rows 1000000 --users 1,4,16,32 --actions 20
+
+The database is the benchmark's synthetic DuckDB file (see benchmark.py).
+Results go to bench/results/load-<commit>-<rows>.json.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from datetime import datetime, timezone
+from pathlib import Path
+
+import duckdb
+
+from bench.benchmark import BENCH_DIR, _git_commit, _peak_rss_mb, _percentile, build_database
+
+APP_PATH = BENCH_DIR.parent / "streamlit_app.py"
+
+PAGES = ["🏠 State Overview", "🔬 HIV Services", "👩‍⚕️ Provider Directory", "📈 Trends", "📋 HCPCS Reference"]
+DIRECTORY = "👩‍⚕️ Provider Directory"
+MAX_STATES = 3  # each click selects 0 (all states) to MAX_STATES states
+SEARCH_TERMS = ["clinic", "health", "garcia", "1000000", "community", "md", "metro"]
+# _serve_sessions_concurrently() patches AppTest internals of this release;
+# re-check it before moving the requirements.txt pin
+STREAMLIT_VERSION = "1.65.0"
+
+
+def _current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+    except OSError:
+        return None  # not Linux; peak RSS is still reported
+
+
+def _serve_sessions_concurrently():
+    """
+    Make AppTest's process-wide state behave like one Streamlit server.
+    Each AppTest rerun installs its own Runtime singleton (with a fresh
+    st.cache_data store), clears it again when done, patches the config and
+    compiles the script into a new ScriptCache. Concurrent sessions would
+    tear the Runtime out from under each other ("Runtime hasn't been
+    created!") and compile in parallel, which CPython's parser doesn't
+    survive ("AST constructor recursion depth mismatch"). Instead, install
+    one Runtime, config patch and ScriptCache for the whole run and leave
+    AppTest a stand-in Runtime class to set and clear.
+    """
+    from contextlib import nullcontext
+    from unittest.mock import MagicMock, patch
+
+    import streamlit
+
+    # Checked before importing the internals, which may have moved
+    if streamlit.__version__ != STREAMLIT_VERSION:
+        sys.exit(f"load test needs streamlit=={STREAMLIT_VERSION} (found {streamlit.__version__}); see requirements.txt")
+
+    from streamlit import config
+    from streamlit.components.v2.component_manager import BidiComponentManager
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.dataframe_source_manager import DataframeSourceManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import app_test, local_script_runner
+    from streamlit.testing.v1.util import build_mock_config_get_option
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.dataframe_source_mgr = DataframeSourceManager()
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    runtime.bidi_component_registry = BidiComponentManager()
+    runtime.bidi_component_registry.discover_and_register_components(start_file_watching=False)
+    Runtime._instance = runtime
+    app_test.Runtime = type("AppTestRuntime", (), {"_instance": None})
+
+    patch.object(config, "get_option", build_mock_config_get_option({"global.appTest": True})).start()
+    app_test.patch_config_options = lambda overrides: nullcontext()
+
+    shared = ScriptCache()
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: shared
+
+
+def _user(seed, actions, timeout, results, lock):
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(seed)
+    at = AppTest.from_file(str(APP_PATH), default_timeout=timeout)
+
+    def rerun(step):
+        start = time.perf_counter()
+        step()
+        elapsed = time.perf_counter() - start
+        with lock:
+            results["latencies"].append(elapsed * 1000)
+            results["errors"] += len(at.exception)
+            if at.exception and results["first_error"] is None:
+                error = at.exception[0]
+                results["first_error"] = f"{error.message}\n" + "\n".join(error.stack_trace)
+            results["busy"] += sum("busy" in warning.value for warning in at.warning)
+
+    try:
+        rerun(at.run)
+        for _ in range(actions):
+            page = rng.choice(PAGES)
+            states = at.sidebar.multiselect[0]
+            at.radio(key="nav").set_value(page)
+            states.set_value(rng.sample(states.options, rng.randint(0, min(MAX_STATES, len(states.options)))))
+            rerun(at.run)
+            if page == DIRECTORY and at.text_input and rng.random() < 0.5:
+                at.text_input[0].input(rng.choice(SEARCH_TERMS))
+                rerun(at.run)
+    except Exception:
+        # A session that dies (e.g. a rerun timing out) counts as an error, not a silent exit
+        with lock:
+            results["errors"] += 1
+            if results["first_error"] is None:
+                results["first_error"] = traceback.format_exc()
+
+
+def _log_stats(log_path, since, until):
+    """Cache hit rate, queue wait and warehouse latency from the query log between two timestamps."""
+    # Imported late: query_log reads TMSIS_QUERY_LOG at import, which main() sets first
+    import query_log
+
+    files = [str(f) for f in Path(log_path).parent.glob(Path(log_path).name + "*")]
+    if not files:
+        return {}
+    conn = duckdb.connect()
+    try:
+        row = conn.execute(f"""
+            SELECT
+                COUNT(*),
+                ROUND(AVG(CASE WHEN cache = 'miss' THEN 0.0 ELSE 1.0 END), 3),
+                ROUND(quantile_cont(queue_ms, 0.95), 1),
+                ROUND(quantile_cont(wall_ms, 0.95) FILTER (WHERE cache = 'miss'), 1)
+            FROM read_json($files, format = 'newline_delimited', columns = {query_log.COLUMNS})
+            WHERE kind = 'query' AND ts >= $since AND ts < $until
+        """, {"files": files, "since": since, "until": until}).fetchone()
+    finally:
+        conn.close()
+    return {"queries": row[0], "cache_hit_rate": row[1], "queue_wait_p95_ms": row[2], "warehouse_p95_ms": row[3]}
+
+
+def run_level(users, actions, timeout, seed, log_path, cold):
+    import streamlit as st
+
+    if cold:
+        st.cache_resource.clear()
+        st.cache_data.clear()
+
+    results = {"latencies": [], "errors": 0, "busy": 0, "first_error": None}
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(target=_user, args=(seed + i, actions, timeout, results, lock), daemon=True)
+        for i in range(users)
+    ]
+    since = datetime.now(timezone.utc).isoformat()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    until = datetime.now(timezone.utc).isoformat()
+
+    latencies = results["latencies"]
+    return {
+        "users": users,
+        "reruns": len(latencies),
+        "seconds": round(elapsed, 2),
+        "reruns_per_second": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": _percentile(latencies, 0.50),
+        "p95_ms": _percentile(latencies, 0.95),
+        "p99_ms": _percentile(latencies, 0.99),
+        "max_ms": max(latencies) if latencies else None,
+        "errors": results["errors"],
+        "first_error": results["first_error"],
+        "busy_rejections": results["busy"],
+        "rss_mb": _current_rss_mb(),
+        "peak_rss_mb": _peak_rss_mb(),
+        **_log_stats(log_path, since, until),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the dashboard with concurrent AppTest sessions.")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Synthetic tmsis_enriched rows")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database", help="DuckDB file to build/reuse (default bench/data/tmsis_<rows>.duckdb)")
+    parser.add_argument("--users", default="1,2,4,8,16,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--actions", type=int, default=20, help="Page/filter changes per user")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds one rerun may take")
+    parser.add_argument("--cold", action="store_true", help="Clear Streamlit caches before each level")
+    parser.add_argument("--output", help="Result JSON path (default bench/results/load-<commit>-<rows>.json)")
+    args = parser.parse_args()
+
+    database = Path(args.database or BENCH_DIR / "data" / f"tmsis_{args.rows}.duckdb")
+    database.parent.mkdir(parents=True, exist_ok=True)
+    build_database(database, args.rows, args.seed)
+    # The app reads these when the first session runs it; its query log is kept apart from logs/
+    log_path = Path(tempfile.mkdtemp(prefix="tmsis-load-")) / "queries.jsonl"
+    os.environ.update({
+        "TMSIS_BACKEND": "duckdb",
+        "TMSIS_DATABASE": str(database),
+        "TMSIS_QUERY_LOG": str(log_path),
+    })
+
+    _serve_sessions_concurrently()
+    levels = []
+    for users in (int(n) for n in args.users.split(",")):
+        levels.append(run_level(users, args.actions, args.timeout, args.seed, log_path, args.cold))
+        level = levels[-1]
+        print(
+            f"{users:3} users  {level['reruns_per_second'] or 0:7.2f} reruns/s  p95 {level['p95_ms'] or 0:9.1f} ms  "
+            f"hit rate {level.get('cache_hit_rate') or 0:.0%}  rss {level['rss_mb']} MB  errors {level['errors']}"
+        )
+        if level["errors"]:
+            # A broken app must not produce a load report that looks like a result
+            print(f"\nfirst error at {users} users:\n{level['first_error']}", file=sys.stderr)
+            sys.exit(f"load test aborted: {level['errors']} error(s) at {users} users; no results written")
+
+    commit = _git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "run_at": datetime.now(timezone.utc).isoformat(),
+            "rows": args.rows,
+            "actions_per_user": args.actions,
+            "cold_levels": args.cold,
+            "query_log": str(log_path),
+            "duckdb_version": duckdb.__version__,
+        },
+        "levels": levels,
+    }
+    output = Path(args.output or BENCH_DIR / "results" / f"load-{commit}-{args.rows}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2) + "\n")
+    print(f"\nresults: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+"""
+Build the typed and derived tables the dashboard reads instead of scanning
+tmsis_enriched.
+
+Usage:
+    MOTHERDUCK_TOKEN=... python build_tables.py
+    python build_tables.py --database local.duckdb
+    python build_tables.py --sync-hiv-reference
+
+Re-run after every refresh of tmsis_enriched. After editing only
+hiv_hcpcs_reference, --sync-hiv-reference recomputes just the changed codes.
+"""
+import argparse
+import time
+
+import duckdb
+
+import dataset_metadata
+import parquet_dataset
+
+STATE_COL = '"Provider Business Practice Location Address State Name"'
+
+
+# ============================================================
+# TYPED CLAIMS
+# Compact, typed copy of tmsis_enriched sorted by state then month, so
+# row-group min/max zone maps skip most of the table on state and year
+# filters. Claim month becomes a DATE plus an integer year and NPIs become
+# BIGINT. State and HCPCS stay VARCHAR: sorted low-cardinality strings are
+# dictionary/RLE compressed by DuckDB's storage, and unlike ENUM types they
+# don't need dropping and recreating on every rebuild.
+# The HIV flag and category are denormalized from hiv_hcpcs_reference so
+# HIV queries filter on a column instead of joining the reference table.
+# ============================================================
+def tmsis_claims_select(source="tmsis_enriched"):
+    """tmsis_claims rows for every claim in source, a table shaped like tmsis_enriched."""
+    return f"""
+        SELECT
+            t.{STATE_COL} AS state,
+            make_date(
+                CAST(LEFT(t.CLAIM_FROM_MONTH, 4) AS INTEGER),
+                CAST(regexp_extract(t.CLAIM_FROM_MONTH, '^[0-9]{{4}}-?([0-9]{{2}})', 1) AS INTEGER),
+                1
+            ) AS claim_month,
+            CAST(LEFT(t.CLAIM_FROM_MONTH, 4) AS SMALLINT) AS year,
+            t.HCPCS_CODE AS hcpcs_code,
+            TRY_CAST(t.BILLING_PROVIDER_NPI_NUM AS BIGINT) AS billing_npi,
+            TRY_CAST(t.SERVICING_PROVIDER_NPI_NUM AS BIGINT) AS servicing_npi,
+            t.TOTAL_CLAIMS AS total_claims,
+            t.TOTAL_UNIQUE_BENEFICIARIES AS total_beneficiaries,
+            t.TOTAL_PAID AS total_paid,
+            h.hcpcs_code IS NOT NULL AS is_hiv,
+            h.category AS hiv_category
+        FROM {source} t
+        LEFT JOIN hiv_hcpcs_reference h ON t.HCPCS_CODE = h.hcpcs_code
+        WHERE t.CLAIM_FROM_MONTH IS NOT NULL
+        ORDER BY state, claim_month
+    """
+
+
+def build_tmsis_claims(conn):
+    conn.execute("CREATE OR REPLACE TABLE tmsis_claims AS " + tmsis_claims_select())
+
+
+# ============================================================
+# HIV CLAIMS ROLLUP
+# Only the 67 HIV codes matter to the HIV pages, so collapse the
+# claims table to one row per state, month, code and NPI pair.
+# ============================================================
+HIV_ROLLUP_SELECT = """
+    SELECT
+        state,
+        claim_month,
+        year,
+        hcpcs_code,
+        hiv_category,
+        billing_npi,
+        servicing_npi,
+        SUM(total_claims) AS total_claims,
+        SUM(total_beneficiaries) AS total_beneficiaries,
+        SUM(total_paid) AS total_paid
+    FROM tmsis_claims
+    WHERE state IS NOT NULL
+      AND is_hiv
+      {codes_filter}
+    GROUP BY 1, 2, 3, 4, 5, 6, 7
+    ORDER BY state, claim_month
+"""
+
+
+def build_hiv_claims_rollup(conn):
+    conn.execute("CREATE OR REPLACE TABLE hiv_claims_rollup AS " + HIV_ROLLUP_SELECT.format(codes_filter=""))
+    # The reference as applied to tmsis_claims; sync_hiv_reference diffs against it
+    conn.execute("CREATE OR REPLACE TABLE hiv_reference_applied AS SELECT hcpcs_code, category FROM hiv_hcpcs_reference")
+
+
+def sync_hiv_reference(conn):
+    """
+    Apply edits to hiv_hcpcs_reference since the last build: re-flag only the
+    added, removed or re-categorized codes in tmsis_claims and rebuild only
+    their rows of hiv_claims_rollup. Returns the changed codes.
+    """
+    changed = [code for (code,) in conn.execute("""
+        SELECT DISTINCT hcpcs_code FROM (
+            (SELECT hcpcs_code, category FROM hiv_hcpcs_reference
+             EXCEPT SELECT hcpcs_code, category FROM hiv_reference_applied)
+            UNION ALL
+            (SELECT hcpcs_code, category FROM hiv_reference_applied
+             EXCEPT SELECT hcpcs_code, category FROM hiv_hcpcs_reference)
+        )
+        ORDER BY hcpcs_code
+    """).fetchall()]
+    if not changed:
+        return changed
+
+    params = {"codes": changed}
+    codes_filter = "AND hcpcs_code IN (SELECT UNNEST($codes))"
+    conn.execute("BEGIN TRANSACTION")
+    try:
+        conn.execute(f"""
+            UPDATE tmsis_claims
+            SET is_hiv = false, hiv_category = NULL
+            WHERE true {codes_filter}
+        """, params)
+        conn.execute("""
+            UPDATE tmsis_claims
+            SET is_hiv = true, hiv_category = h.category
+            FROM hiv_hcpcs_reference h
+            WHERE tmsis_claims.hcpcs_code = h.hcpcs_code
+              AND h.hcpcs_code IN (SELECT UNNEST($codes))
+        """, params)
+        conn.execute(f"DELETE FROM hiv_claims_rollup WHERE true {codes_filter}", params)
+        conn.execute("INSERT INTO hiv_claims_rollup " + HIV_ROLLUP_SELECT.format(codes_filter=codes_filter), params)
+        conn.execute("CREATE OR REPLACE TABLE hiv_reference_applied AS SELECT hcpcs_code, category FROM hiv_hcpcs_reference")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return changed
+
+
+# ============================================================
+# PROVIDER DIMENSION
+# One row per NPI with the directory's display fields precomputed, so the
+# directory aggregates claims by NPI first and only then joins this.
+# billing_name and provider_name keep the two naming rules the billing and
+# servicing views have always used. search_text is the lowercased,
+# accent- and punctuation-free text the directory search matches, and a
+# full-text index over it ranks results when the fts extension is available.
+# ============================================================
+PROVIDER_DIM_SELECT = """
+    SELECT
+        TRY_CAST(NPI AS BIGINT) AS npi,
+        entity_type,
+        COALESCE(org_name, first_name || ' ' || last_name) AS billing_name,
+        COALESCE(
+            CASE WHEN entity_type = '2' THEN org_name
+                 ELSE first_name || ' ' || last_name END,
+            'Unknown'
+        ) AS provider_name,
+        credentials,
+        taxonomy_1 AS taxonomy,
+        address,
+        city,
+        state,
+        zip,
+        phone,
+        trim(regexp_replace(
+            lower(strip_accents(concat_ws(' ',
+                NPI, org_name, first_name, last_name, credentials, taxonomy_1, city, state, zip
+            ))),
+            '[^a-z0-9]+', ' ', 'g'
+        )) AS search_text
+    FROM npi_lookup
+    WHERE TRY_CAST(NPI AS BIGINT) IS NOT NULL
+      {npi_filter}
+    ORDER BY npi
+"""
+
+
+def build_provider_dim(conn):
+    conn.execute("CREATE OR REPLACE TABLE provider_dim AS " + PROVIDER_DIM_SELECT.format(npi_filter=""))
+
+
+def build_search_index(conn, log=print):
+    try:
+        conn.execute("""
+            PRAGMA create_fts_index(
+                'provider_dim', 'npi', 'search_text',
+                stemmer = 'none', stopwords = 'none', overwrite = 1
+            )
+        """)
+    except duckdb.Error as exc:
+        # Substring search still works; only relevance ranking is unavailable
+        if log:
+            log(f"provider_dim: full-text index skipped ({exc})")
+
+
+# ============================================================
+# STATE x YEAR SUMMARY CUBE
+# Distinct provider counts don't add across cells, so each cell keeps
+# its sorted billing NPI list; merging lists answers any state/year
+# combination exactly.
+# ============================================================
+STATE_YEAR_SUMMARY_SELECT = """
+    SELECT
+        state,
+        year,
+        SUM(total_claims) AS total_claims,
+        SUM(total_beneficiaries) AS total_beneficiaries,
+        SUM(total_paid) AS total_paid,
+        list_sort(LIST(DISTINCT billing_npi) FILTER (WHERE billing_npi IS NOT NULL)) AS billing_npis
+    FROM tmsis_claims
+    WHERE state IS NOT NULL
+      {cell_filter}
+    GROUP BY 1, 2
+    ORDER BY state, year
+"""
+
+
+def build_state_year_summary(conn):
+    conn.execute("CREATE OR REPLACE TABLE state_year_summary AS " + STATE_YEAR_SUMMARY_SELECT.format(cell_filter=""))
+
+
+# ============================================================
+# DATASET METADATA CATALOG
+# Everything the sidebar needs, so new sessions never scan the claims.
+# data_version only changes when the loaded data or HIV reference does;
+# checksums of the summary cube and provider_dim catch incremental
+# ingests (ingest.py) that move claims between states or rename providers
+# without changing the overall totals.
+# ============================================================
+def build_dataset_metadata(conn):
+    conn.execute("""
+        CREATE OR REPLACE TABLE dataset_metadata AS
+        SELECT
+            (SELECT list_sort(LIST(DISTINCT state)) FROM state_year_summary) AS states,
+            c.years,
+            c.min_month,
+            c.max_month,
+            c.row_count,
+            md5(concat_ws('|', c.row_count, c.min_month, c.max_month, c.total_paid, (
+                SELECT string_agg(hcpcs_code || '=' || category, ',' ORDER BY hcpcs_code)
+                FROM hiv_hcpcs_reference
+            ), (
+                SELECT SUM(hash(state, year, total_claims, total_paid, billing_npis)) FROM state_year_summary
+            ), (
+                SELECT SUM(hash(npi, search_text, address, phone)) FROM provider_dim
+            ))) AS data_version,
+            CAST(now() AS TIMESTAMP) AS refreshed_at
+        FROM (
+            SELECT
+                list_sort(LIST(DISTINCT year)) AS years,
+                MIN(claim_month) AS min_month,
+                MAX(claim_month) AS max_month,
+                COUNT(*) AS row_count,
+                SUM(total_paid) AS total_paid
+            FROM tmsis_claims
+        ) c
+    """)
+
+
+BUILD_STEPS = [
+    ("tmsis_claims", build_tmsis_claims),
+    ("hiv_claims_rollup", build_hiv_claims_rollup),
+    ("provider_dim", build_provider_dim),
+    ("state_year_summary", build_state_year_summary),
+    ("dataset_metadata", build_dataset_metadata),
+]
+
+
+def build_all(conn, log=print):
+    for name, step in BUILD_STEPS:
+        start = time.perf_counter()
+        step(conn)
+        if log:
+            rows = conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+            log(f"{name}: {rows:,} rows in {time.perf_counter() - start:.1f}s")
+    build_search_index(conn, log=log)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build derived dashboard tables.")
+    parser.add_argument("--database", default="md:my_db", help="DuckDB/MotherDuck database to build in (default: md:my_db)")
+    parser.add_argument("--sync-hiv-reference", action="store_true",
+                        help="Only apply hiv_hcpcs_reference edits to the existing tables instead of a full build")
+    parser.add_argument("--export-parquet", metavar="ROOT", help="Also export the tables as a state/year-partitioned Parquet dataset")
+    parser.add_argument("--snapshot", help="Where to write the metadata snapshot the app reads at startup "
+                                           "(default: dataset_metadata.json when building in MotherDuck)")
+    args = parser.parse_args()
+
+    conn = duckdb.connect(args.database)
+    if args.sync_hiv_reference:
+        changed = sync_hiv_reference(conn)
+        print(f"hiv reference: {len(changed)} changed code(s) {', '.join(changed)}")
+        build_dataset_metadata(conn)
+    else:
+        build_all(conn)
+
+    # Only the production build refreshes the checked-in snapshot by default
+    snapshot = args.snapshot or (dataset_metadata.SNAPSHOT_PATH if args.database.startswith("md:") else None)
+    if snapshot:
+        dataset_metadata.write_snapshot(dataset_metadata.fetch(conn), snapshot)
+        print(f"metadata snapshot: {snapshot}")
+
+    if args.export_parquet:
+        parquet_dataset.export(conn, args.export_parquet)
+        print(f"parquet export: {args.export_parquet}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Dataset metadata catalog: state list, year and month range, row count, data
+version and refresh time for the loaded tmsis_enriched.
+
+build_tables.py writes the one-row ``dataset_metadata`` table and ingest.py
+refreshes it; both also write a JSON snapshot of it for MotherDuck builds.
+The app paints the sidebar from the snapshot without waiting on the
+warehouse, and switches to the table's row once the query runner sees a
+different data version.
+"""
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+SNAPSHOT_PATH = Path(os.environ.get("TMSIS_METADATA_SNAPSHOT", Path(__file__).parent / "dataset_metadata.json"))
+
+
+def fetch(conn):
+    """Read the dataset_metadata table as a JSON-friendly dict."""
+    cursor = conn.execute("""
+        SELECT states, years, min_month, max_month, row_count, data_version, refreshed_at
+        FROM dataset_metadata
+    """)
+    columns = [col[0] for col in cursor.description]
+    meta = dict(zip(columns, cursor.fetchone()))
+    for key in ("min_month", "max_month", "refreshed_at"):
+        meta[key] = meta[key].isoformat()
+    return meta
+
+
+def current_version(conn):
+    """The loaded data's version, cheap enough to poll."""
+    return conn.execute("SELECT data_version FROM dataset_metadata").fetchone()[0]
+
+
+def read_snapshot(path=SNAPSHOT_PATH):
+    path = Path(path)
+    if not path.exists():
+        return None
+    return json.loads(path.read_text())
+
+
+def write_snapshot(meta, path=SNAPSHOT_PATH):
+    Path(path).write_text(json.dumps(meta, indent=2) + "\n")
+
+
+def row_count_label(meta):
+    """'227.4M' style label for the sidebar footer, down to plain counts for small datasets."""
+    count = meta["row_count"]
+    for size, suffix in ((10**9, "B"), (10**6, "M"), (10**3, "K")):
+        value = round(count / size, 1)
+        if value >= 1:
+            return f"{value:,.1f}".removesuffix(".0") + suffix
+    return f"{count:,}"
+
+
+def refreshed_label(meta):
+    """'February 2026' style label for the sidebar footer."""
+    return datetime.fromisoformat(meta["refreshed_at"]).strftime("%B %Y")
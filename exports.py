@@ -0,0 +1,86 @@
+"""
+On-demand downloads in CSV, Parquet or Arrow IPC.
+
+Nothing is serialized until someone asks for an export. Query exports stream
+DuckDB's result as Arrow record batches into a temp file, so a full
+multi-state extract never exists as a DataFrame or a CSV string. Results a
+page already holds are written straight from their cached Arrow tables.
+
+Streamlit keeps a download's bytes in server memory for as long as the
+button is shown, so the finished file is read back once and then deleted,
+and an export that grows past ``MAX_BYTES`` on disk is abandoned with
+ExportTooLarge before anything is read into memory.
+"""
+import os
+import tempfile
+from dataclasses import dataclass
+
+from pyarrow import csv, ipc, parquet
+
+import arrow_results
+
+BATCH_ROWS = 100_000
+MAX_BYTES = int(os.environ.get("TMSIS_EXPORT_MAX_MB", 200)) * 2**20
+
+
+class ExportTooLarge(ValueError):
+    """The export file would be bigger than MAX_BYTES."""
+
+
+@dataclass(frozen=True)
+class ExportFormat:
+    extension: str
+    mime: str
+
+
+FORMATS = {
+    "CSV": ExportFormat("csv", "text/csv"),
+    "Parquet": ExportFormat("parquet", "application/vnd.apache.parquet"),
+    "Arrow IPC": ExportFormat("arrow", "application/vnd.apache.arrow.file"),
+}
+
+
+def filename(stem, fmt):
+    return f"{stem}.{FORMATS[fmt].extension}"
+
+
+def _writer(fmt, path, schema):
+    if fmt == "CSV":
+        return csv.CSVWriter(path, schema)
+    if fmt == "Parquet":
+        return parquet.ParquetWriter(path, schema, compression="zstd")
+    if fmt == "Arrow IPC":
+        return ipc.new_file(path, schema)
+    raise ValueError(f"Unknown export format '{fmt}' (expected {', '.join(FORMATS)})")
+
+
+def _spool(batches, schema, fmt, max_bytes):
+    """Write record batches to a temp file one at a time and return the file's bytes."""
+    fd, path = tempfile.mkstemp(prefix="tmsis-export-", suffix="." + FORMATS[fmt].extension)
+    os.close(fd)
+    try:
+        with _writer(fmt, path, schema) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+                if os.path.getsize(path) > max_bytes:
+                    break
+        size = os.path.getsize(path)
+        if size > max_bytes:
+            raise ExportTooLarge(f"Export exceeds {max_bytes / 2**20:,.0f} MB; narrow the filters and try again")
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+
+def query_bytes(conn, sql, params, fmt, max_bytes=MAX_BYTES):
+    """Export a query's full result, streamed from DuckDB in BATCH_ROWS batches."""
+    reader = conn.execute(sql, params or None).to_arrow_reader(BATCH_ROWS)
+    return _spool(reader, reader.schema, fmt, max_bytes)
+
+
+def table_bytes(table, fmt, max_bytes=MAX_BYTES):
+    """Export an Arrow table the page already holds."""
+    if fmt == "CSV":
+        table = arrow_results.decode(table)
+    return _spool(table.to_batches(BATCH_ROWS), table.schema, fmt, max_bytes)
@@ -0,0 +1,343 @@
+"""
+Incremental ingestion of T-MSIS provider-spending releases and NPPES
+refreshes into tmsis_enriched and npi_lookup, and from there into the
+derived tables without a full rebuild.
+
+1. Every raw file (T-MSIS as CSV or Parquet, NPPES as the CMS CSV) is
+   streamed into a typed staging table, files in parallel on their own
+   cursors. DuckDB reads each file in chunks, so no file is ever held in
+   memory whole.
+2. NPPES rows that differ from npi_lookup are upserted, and their NPIs
+   recorded in npi_changes with the practice state before and after.
+3. Claim months not loaded yet are enriched with the billing NPI's state
+   and appended to tmsis_enriched. With --replace-months, a release's rows
+   also replace months already loaded (restated data).
+4. Existing claims are re-enriched only for NPIs whose state changed.
+5. tmsis_claims and hiv_claims_rollup are updated for just those months
+   and NPIs, state_year_summary for just the affected state/year cells,
+   provider_dim for just the changed NPIs, and dataset_metadata is
+   recomputed.
+
+Usage:
+    MOTHERDUCK_TOKEN=... python ingest.py --tmsis releases/2025-01.csv --nppes npidata_pfile.csv
+    python ingest.py --database local.duckdb --tmsis 'releases/*.parquet' --replace-months
+
+On a database without the derived tables, the raw files are loaded and
+build_tables.build_all() builds the rest. Appended months land after
+tmsis_claims' state/month sort order; their row groups still carry tight
+zone maps, and the next full build_tables.py run restores one global order.
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import duckdb
+
+import build_tables
+import dataset_metadata
+
+# Raw T-MSIS provider-spending columns and their types in tmsis_enriched
+TMSIS_COLUMNS = {
+    "BILLING_PROVIDER_NPI_NUM": "VARCHAR",
+    "SERVICING_PROVIDER_NPI_NUM": "VARCHAR",
+    "HCPCS_CODE": "VARCHAR",
+    "CLAIM_FROM_MONTH": "VARCHAR",
+    "TOTAL_UNIQUE_BENEFICIARIES": "BIGINT",
+    "TOTAL_CLAIMS": "BIGINT",
+    "TOTAL_PAID": "DOUBLE",
+}
+
+# npi_lookup column -> NPPES data dissemination file header
+NPPES_COLUMNS = {
+    "NPI": "NPI",
+    "entity_type": "Entity Type Code",
+    "org_name": "Provider Organization Name (Legal Business Name)",
+    "first_name": "Provider First Name",
+    "last_name": "Provider Last Name (Legal Name)",
+    "credentials": "Provider Credential Text",
+    "taxonomy_1": "Healthcare Provider Taxonomy Code_1",
+    "address": "Provider First Line Business Practice Location Address",
+    "city": "Provider Business Practice Location Address City Name",
+    "state": "Provider Business Practice Location Address State Name",
+    "zip": "Provider Business Practice Location Address Postal Code",
+    "phone": "Provider Business Practice Location Address Telephone Number",
+}
+
+STAGING_TABLES = ("tmsis_staging", "npi_staging", "tmsis_new", "npi_changes")
+
+
+def _quote(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _exists(conn, table):
+    return conn.execute("""
+        SELECT COUNT(*) FROM duckdb_tables()
+        WHERE database_name = current_database() AND schema_name = 'main' AND table_name = ?
+    """, [table]).fetchone()[0] > 0
+
+
+def _match_any(columns, values):
+    """
+    ('AND (col IN (...) OR ...)', params) over the columns whose value lists
+    are non-empty, or (None, {}) when all are empty.
+    """
+    params = {name: values[name] for name in columns.values() if values[name]}
+    clauses = [f"{column} IN (SELECT UNNEST(${name}))" for column, name in columns.items() if name in params]
+    return ("AND (" + " OR ".join(clauses) + ")" if clauses else None), params
+
+
+# ============================================================
+# STAGING
+# Raw files are read as text and cast here, so a malformed value becomes
+# NULL instead of failing a 227M-row load.
+# ============================================================
+def create_raw_tables(conn):
+    """Create empty tmsis_enriched and npi_lookup on a fresh database."""
+    tmsis_columns = ", ".join(f"{name} {type_}" for name, type_ in TMSIS_COLUMNS.items())
+    conn.execute(f"CREATE TABLE IF NOT EXISTS tmsis_enriched ({tmsis_columns}, {build_tables.STATE_COL} VARCHAR)")
+    conn.execute(f"CREATE TABLE IF NOT EXISTS npi_lookup ({', '.join(f'{name} VARCHAR' for name in NPPES_COLUMNS)})")
+
+
+def _tmsis_load(path):
+    source = (
+        f"read_parquet({_quote(path)})" if path.endswith(".parquet")
+        else f"read_csv({_quote(path)}, header = true, all_varchar = true)"
+    )
+    columns = ", ".join(f'TRY_CAST("{name}" AS {type_}) AS {name}' for name, type_ in TMSIS_COLUMNS.items())
+    return f"INSERT INTO tmsis_staging SELECT {columns} FROM {source}"
+
+
+def _nppes_load(path, file_index):
+    columns = ", ".join(
+        # ZIP+4 is cut to the five-digit ZIP the directory shows
+        f'LEFT(TRIM("{header}"), 5) AS {name}' if name == "zip" else f'NULLIF(TRIM("{header}"), \'\') AS {name}'
+        for name, header in NPPES_COLUMNS.items()
+    )
+    return f"""
+        INSERT INTO npi_staging
+        SELECT {columns}, {int(file_index)} AS file_index
+        FROM read_csv({_quote(path)}, header = true, all_varchar = true)
+    """
+
+
+def load_staging(conn, tmsis_paths=(), nppes_paths=(), workers=4, log=print):
+    """Stream every raw file into tmsis_staging / npi_staging, several files at once."""
+    conn.execute(f"""
+        CREATE OR REPLACE TABLE tmsis_staging ({', '.join(f'{name} {type_}' for name, type_ in TMSIS_COLUMNS.items())})
+    """)
+    conn.execute(f"""
+        CREATE OR REPLACE TABLE npi_staging ({', '.join(f'{name} VARCHAR' for name in NPPES_COLUMNS)}, file_index INTEGER)
+    """)
+    loads = [(path, _tmsis_load(path)) for path in tmsis_paths]
+    loads += [(path, _nppes_load(path, i)) for i, path in enumerate(nppes_paths)]
+
+    def run(load):
+        path, sql = load
+        start = time.perf_counter()
+        with conn.cursor() as cursor:
+            rows = cursor.execute(sql).fetchone()[0]
+        return path, rows, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for path, rows, elapsed in pool.map(run, loads):
+            if log:
+                log(f"staged {path}: {rows:,} rows in {elapsed:.1f}s")
+
+
+# ============================================================
+# RAW TABLE MERGES
+# ============================================================
+def merge_nppes(conn):
+    """
+    Upsert NPPES rows that differ from npi_lookup (later files win for an
+    NPI listed twice) and record them in npi_changes. Returns the count.
+    """
+    columns = ", ".join(NPPES_COLUMNS)
+    conn.execute(f"""
+        CREATE OR REPLACE TABLE npi_staging AS
+        SELECT {columns} FROM npi_staging
+        WHERE NPI IS NOT NULL
+        QUALIFY row_number() OVER (PARTITION BY NPI ORDER BY file_index DESC) = 1
+    """)
+    conn.execute(f"""
+        CREATE OR REPLACE TABLE npi_changes AS
+        SELECT s.NPI, l.state AS old_state, s.state AS new_state
+        FROM (SELECT {columns} FROM npi_staging EXCEPT SELECT {columns} FROM npi_lookup) s
+        LEFT JOIN npi_lookup l ON l.NPI = s.NPI
+    """)
+    conn.execute("BEGIN TRANSACTION")
+    try:
+        conn.execute("DELETE FROM npi_lookup WHERE NPI IN (SELECT NPI FROM npi_changes)")
+        conn.execute(f"""
+            INSERT INTO npi_lookup ({columns})
+            SELECT {columns} FROM npi_staging WHERE NPI IN (SELECT NPI FROM npi_changes)
+        """)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return conn.execute("SELECT COUNT(*) FROM npi_changes").fetchone()[0]
+
+
+def merge_tmsis(conn, replace_months=False):
+    """
+    Enrich and append the staged claim months tmsis_enriched doesn't have
+    (or, with replace_months, every staged month). The appended rows are
+    kept in tmsis_new for the derived tables; returns their claim_month dates.
+    """
+    loaded = "" if replace_months else "EXCEPT SELECT DISTINCT CLAIM_FROM_MONTH FROM tmsis_enriched"
+    months = [month for (month,) in conn.execute(f"""
+        SELECT DISTINCT CLAIM_FROM_MONTH FROM tmsis_staging WHERE CLAIM_FROM_MONTH IS NOT NULL
+        {loaded}
+    """).fetchall()]
+    if not months:
+        return []
+
+    columns = ", ".join(TMSIS_COLUMNS)
+    state_col = build_tables.STATE_COL
+    conn.execute(f"""
+        CREATE OR REPLACE TABLE tmsis_new AS
+        SELECT {', '.join('s.' + name for name in TMSIS_COLUMNS)}, n.state AS {state_col}
+        FROM tmsis_staging s
+        LEFT JOIN npi_lookup n ON n.NPI = s.BILLING_PROVIDER_NPI_NUM
+        WHERE s.CLAIM_FROM_MONTH IN (SELECT UNNEST($months))
+    """, {"months": months})
+    conn.execute("BEGIN TRANSACTION")
+    try:
+        if replace_months:
+            conn.execute("DELETE FROM tmsis_enriched WHERE CLAIM_FROM_MONTH IN (SELECT UNNEST($months))", {"months": months})
+        conn.execute(f"INSERT INTO tmsis_enriched ({columns}, {state_col}) SELECT {columns}, {state_col} FROM tmsis_new")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return [month for (month,) in conn.execute(f"""
+        SELECT DISTINCT claim_month FROM ({build_tables.tmsis_claims_select('tmsis_new')}) ORDER BY 1
+    """).fetchall()]
+
+
+# ============================================================
+# DERIVED TABLES
+# Every derived table groups by month, billing NPI or state/year cell, so
+# deleting the rows a predicate selects and re-inserting the groups that
+# satisfy it is exact.
+# ============================================================
+def refresh_derived(conn, months, log=print):
+    """Bring the derived tables up to date with the appended months and npi_changes."""
+    moved = conn.execute("""
+        SELECT TRY_CAST(NPI AS BIGINT), old_state, new_state
+        FROM npi_changes
+        WHERE old_state IS DISTINCT FROM new_state
+    """).fetchall()
+    values = {
+        "months": months,
+        "npis": sorted({npi for npi, _, _ in moved if npi is not None}),
+        "states": sorted({state for _, old, new in moved for state in (old, new) if state is not None}),
+        "years": sorted({month.year for month in months}),
+    }
+    rows_filter, rows_params = _match_any({"claim_month": "months", "billing_npi": "npis"}, values)
+    cell_filter, cell_params = _match_any({"state": "states", "year": "years"}, values)
+    changed_npis = conn.execute("SELECT COUNT(*) FROM npi_changes").fetchone()[0]
+
+    conn.execute("BEGIN TRANSACTION")
+    try:
+        if moved:
+            # Re-enrich only the claims of NPIs whose practice state changed
+            conn.execute(f"""
+                UPDATE tmsis_enriched SET {build_tables.STATE_COL} = c.new_state
+                FROM npi_changes c
+                WHERE tmsis_enriched.BILLING_PROVIDER_NPI_NUM = c.NPI
+                  AND c.old_state IS DISTINCT FROM c.new_state
+            """)
+            conn.execute("""
+                UPDATE tmsis_claims SET state = c.new_state
+                FROM npi_changes c
+                WHERE tmsis_claims.billing_npi = TRY_CAST(c.NPI AS BIGINT)
+                  AND c.old_state IS DISTINCT FROM c.new_state
+            """)
+        if months:
+            conn.execute("DELETE FROM tmsis_claims WHERE claim_month IN (SELECT UNNEST($months))", {"months": months})
+            conn.execute("INSERT INTO tmsis_claims " + build_tables.tmsis_claims_select("tmsis_new"))
+        if rows_filter:
+            conn.execute(f"DELETE FROM hiv_claims_rollup WHERE true {rows_filter}", rows_params)
+            conn.execute(
+                "INSERT INTO hiv_claims_rollup " + build_tables.HIV_ROLLUP_SELECT.format(codes_filter=rows_filter),
+                rows_params,
+            )
+        if cell_filter:
+            conn.execute(f"DELETE FROM state_year_summary WHERE true {cell_filter}", cell_params)
+            conn.execute(
+                "INSERT INTO state_year_summary " + build_tables.STATE_YEAR_SUMMARY_SELECT.format(cell_filter=cell_filter),
+                cell_params,
+            )
+        if changed_npis:
+            conn.execute("DELETE FROM provider_dim WHERE npi IN (SELECT TRY_CAST(NPI AS BIGINT) FROM npi_changes)")
+            conn.execute("INSERT INTO provider_dim " + build_tables.PROVIDER_DIM_SELECT.format(
+                npi_filter="AND NPI IN (SELECT NPI FROM npi_changes)",
+            ))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+    if changed_npis:
+        build_tables.build_search_index(conn, log=log)
+    build_tables.build_dataset_metadata(conn)
+    if log:
+        log(f"derived tables: {len(months)} month(s), {changed_npis:,} changed NPI(s), {len(moved):,} moved state")
+
+
+def ingest(conn, tmsis_paths=(), nppes_paths=(), replace_months=False, workers=4, log=print):
+    """Load raw files and update every table that depends on them; returns (months, changed NPIs)."""
+    create_raw_tables(conn)
+    full_build = not _exists(conn, "dataset_metadata")
+    if not full_build:
+        # Keep tmsis_claims' HIV flags in step with the reference the new rows are flagged with
+        build_tables.sync_hiv_reference(conn)
+    try:
+        load_staging(conn, tmsis_paths, nppes_paths, workers=workers, log=log)
+        start = time.perf_counter()
+        changed_npis = merge_nppes(conn)
+        months = merge_tmsis(conn, replace_months=replace_months)
+        if log:
+            log(f"raw tables: {len(months)} new month(s), {changed_npis:,} changed NPI(s) "
+                f"in {time.perf_counter() - start:.1f}s")
+        if full_build:
+            build_tables.build_all(conn, log=log)
+        else:
+            refresh_derived(conn, months, log=log)
+    finally:
+        for table in STAGING_TABLES:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+    return months, changed_npis
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally ingest T-MSIS releases and NPPES refreshes.")
+    parser.add_argument("--database", default="md:my_db", help="DuckDB/MotherDuck database to load into (default: md:my_db)")
+    parser.add_argument("--tmsis", nargs="*", default=[], metavar="PATH",
+                        help="Raw T-MSIS provider-spending files (CSV or Parquet; globs allowed)")
+    parser.add_argument("--nppes", nargs="*", default=[], metavar="PATH",
+                        help="NPPES CSV files, full or weekly; later files win for the same NPI")
+    parser.add_argument("--replace-months", action="store_true",
+                        help="Replace claim months that are already loaded instead of skipping them")
+    parser.add_argument("--workers", type=int, default=4, help="Raw files staged at once")
+    parser.add_argument("--snapshot", help="Where to write the metadata snapshot the app reads at startup "
+                                           "(default: dataset_metadata.json when loading into MotherDuck)")
+    args = parser.parse_args()
+
+    conn = duckdb.connect(args.database)
+    start = time.perf_counter()
+    ingest(conn, args.tmsis, args.nppes, replace_months=args.replace_months, workers=args.workers)
+    print(f"ingest finished in {time.perf_counter() - start:.1f}s")
+
+    snapshot = args.snapshot or (dataset_metadata.SNAPSHOT_PATH if args.database.startswith("md:") else None)
+    if snapshot:
+        dataset_metadata.write_snapshot(dataset_metadata.fetch(conn), snapshot)
+        print(f"metadata snapshot: {snapshot}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
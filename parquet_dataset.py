@@ -0,0 +1,122 @@
+"""
+Parquet dataset mode: run the dashboard against a Parquet export instead of
+MotherDuck.
+
+Layout under the export root (local path or object-storage URL)::
+
+    tmsis_claims/state=<state>/year=<year>/*.parquet
+    hiv_claims_rollup/state=<state>/year=<year>/*.parquet
+    state_year_summary.parquet
+    dataset_metadata.parquet
+    hiv_hcpcs_reference.parquet
+    npi_lookup.parquet
+    provider_dim.parquet
+
+Every table is exposed as a view on an in-memory DuckDB connection. Queries
+over the partitioned tables don't go through the views: ``scan()`` turns the
+selected states and years into an explicit list of partition files, so a
+one-state query only ever opens that state's files.
+
+Write an export with ``python build_tables.py --export-parquet <root>``.
+"""
+import posixpath
+import shutil
+from pathlib import Path
+from urllib.parse import unquote
+
+import duckdb
+
+PARTITIONED_TABLES = ("tmsis_claims", "hiv_claims_rollup")
+SINGLE_FILE_TABLES = ("state_year_summary", "dataset_metadata", "hiv_hcpcs_reference", "npi_lookup", "provider_dim")
+HIVE_OPTIONS = "hive_partitioning = true, hive_types = {'state': VARCHAR, 'year': SMALLINT}"
+
+
+def _quote(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def export(conn, root):
+    """
+    Write the build's tables from conn to a Parquet dataset at root.
+
+    A local root is written to a sibling directory and swapped in once
+    complete, so it never keeps partitions an earlier export had and this
+    one doesn't. Object storage can't rename a directory, so a remote root
+    must be new.
+    """
+    if "://" in root:
+        if conn.execute("SELECT COUNT(*) FROM glob(?)", [posixpath.join(root, "*")]).fetchone()[0]:
+            raise ValueError(f"{root} already holds files; export to a new root")
+        _write(conn, root)
+        return
+
+    target = Path(root)
+    partial = target.with_name(target.name + ".partial")
+    old = target.with_name(target.name + ".old")
+    shutil.rmtree(partial, ignore_errors=True)
+    partial.mkdir(parents=True)
+    try:
+        _write(conn, str(partial))
+        if target.exists():
+            shutil.rmtree(old, ignore_errors=True)
+            target.rename(old)
+        partial.rename(target)
+        shutil.rmtree(old, ignore_errors=True)
+    finally:
+        shutil.rmtree(partial, ignore_errors=True)
+
+
+def _write(conn, root):
+    for table in PARTITIONED_TABLES:
+        conn.execute(f"""
+            COPY (SELECT * FROM {table})
+            TO {_quote(posixpath.join(root, table))}
+            (FORMAT parquet, PARTITION_BY (state, year))
+        """)
+    for table in SINGLE_FILE_TABLES:
+        conn.execute(f"COPY {table} TO {_quote(posixpath.join(root, table + '.parquet'))} (FORMAT parquet)")
+
+
+class ParquetDataset:
+    def __init__(self, root):
+        self.root = root.rstrip("/")
+        self._files = {}  # table -> [(state, year, path)]
+
+    def connect(self):
+        conn = duckdb.connect()
+        for table in PARTITIONED_TABLES:
+            self._files[table] = self._list_partitions(conn, table)
+            conn.execute(f"""
+                CREATE VIEW {table} AS
+                SELECT * FROM read_parquet({_quote(self._table_glob(table))}, {HIVE_OPTIONS})
+            """)
+        for table in SINGLE_FILE_TABLES:
+            conn.execute(f"CREATE VIEW {table} AS SELECT * FROM read_parquet({_quote(f'{self.root}/{table}.parquet')})")
+        return conn
+
+    def scan(self, table, params):
+        """SQL source for table that only reads the partitions the filters select."""
+        if table not in self._files:
+            return table
+        states = set(params.get("states", ()))
+        years = {int(y) for y in params.get("years", ())}
+        files = [
+            path for state, year, path in self._files[table]
+            if (not states or state in states) and (not years or year in years)
+        ]
+        if not files:
+            return f"(SELECT * FROM {table} WHERE false)"
+        file_list = ", ".join(_quote(path) for path in files)
+        return f"read_parquet([{file_list}], {HIVE_OPTIONS})"
+
+    def _table_glob(self, table):
+        return f"{self.root}/{table}/*/*/*.parquet"
+
+    def _list_partitions(self, conn, table):
+        partitions = []
+        for (path,) in conn.execute("SELECT file FROM glob(?) ORDER BY file", [self._table_glob(table)]).fetchall():
+            state_dir, year_dir = path.split("/")[-3:-1]
+            state = unquote(state_dir.partition("=")[2])
+            year = year_dir.partition("=")[2]
+            partitions.append((state, int(year) if year.isdigit() else None, path))
+        return partitions
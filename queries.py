@@ -0,0 +1,479 @@
+"""
+SQL templates for every dashboard query and the filter binding that turns
+sidebar selections into DuckDB parameters.
+
+Filter values are never inlined into the SQL. Each active filter adds a
+``column IN (SELECT UNNEST($name))`` predicate and its values are bound as a
+DuckDB list parameter, so a template renders to one of a handful of stable
+statements and the warehouse can reuse their plans. The IN-subquery is
+planned as a semi join whose min/max is pushed into the table scan, so
+filters on the sort-ordered state/year columns prune row groups by zone map. Cache keys are built
+from the template ID plus the sorted filter values, so picking CA then NY
+hits the same entry as NY then CA.
+
+Partitioned tables are written as ``{table}`` slots. By default they render
+as the table name; a Parquet dataset (parquet_dataset.py) substitutes a scan
+of only the partition files the filters select.
+
+Templates may also declare ``dimensions``: filters whose values appear as a
+column of every result row, so a narrower selection can be answered by
+slicing a wider cached result (see result_cache.py). Page templates whose
+filters merge rows declare a ``rollup`` as well: their SQL returns a cube
+that keeps every dimension, with the billing NPIs of each cell as a list,
+and the rollup re-aggregates a slice of it in-process. Merging the NPI lists
+keeps distinct provider counts exact.
+
+Paged templates (the Provider Directory) declare unique ``keys`` and
+``sort_columns`` and are rendered with ``render_page()``, which pushes the
+search text, category and sort into SQL and returns one keyset page plus
+totals for the whole match, so no session ever holds the full directory.
+Search terms match provider_dim's precomputed ``search_text`` column and,
+where build_tables.py created its full-text index, can be ranked by BM25.
+"""
+import re
+import unicodedata
+from dataclasses import dataclass, field
+
+
+@dataclass(frozen=True)
+class QueryTemplate:
+    sql: str
+    # filter name -> column expression the filter's values are matched against
+    filters: dict = field(default_factory=dict)
+    # filter name -> result column holding that filter's value on every row.
+    # Slicing on these is exact for every measure, including distinct counts,
+    # because no rows are merged.
+    dimensions: dict = field(default_factory=dict)
+    # SQL over the template's result (as ``cube``) that produces the rows the
+    # page shows; see rollup(). Without it the result is shown as is.
+    rollup: str = None
+    # Paged templates only: result columns that identify a row, which break
+    # sort ties for keyset pagination
+    keys: tuple = ()
+    # result column -> value standing in for NULL when sorting by it; the
+    # first entry is the default sort. Paged templates also return a
+    # search_text column, which render_page() matches and then drops.
+    sort_columns: dict = field(default_factory=dict)
+
+
+# Tables a backend may replace with a partition-pruned scan
+TABLE_SLOTS = ("hiv_claims_rollup",)
+
+# Filter columns shared by every query over hiv_claims_rollup
+ROLLUP_FILTERS = {
+    "states": "t.state",
+    "years": "t.year",
+    "codes": "t.hcpcs_code",
+}
+
+# Distinct billing NPIs across the merged cube cells
+MERGED_PROVIDERS = "len(list_distinct(flatten(LIST(billing_npis))))"
+
+# Sortable measures shared by the directory views
+DIRECTORY_SORTS = {
+    "total_hiv_claims": 0,
+    "total_beneficiaries": 0,
+    "total_paid": 0,
+    "hiv_service_categories": 0,
+}
+
+# Sort by full-text relevance to the search terms (needs the provider_dim index)
+RELEVANCE = "relevance"
+SEARCH_INDEX_SCHEMA = "fts_main_provider_dim"
+MAX_SEARCH_TERMS = 8
+
+# Totals over every row a directory search matches, returned on each page row
+PAGE_TOTALS = {
+    "matched_rows": "COUNT(*)",
+    "matched_claims": "SUM(total_hiv_claims)",
+    "matched_beneficiaries": "SUM(total_beneficiaries)",
+    "matched_paid": "ROUND(SUM(total_paid), 2)",
+}
+
+TEMPLATES = {
+    # ------------------------------------------------------------
+    # Reference (the sidebar reads dataset_metadata.py instead)
+    # ------------------------------------------------------------
+    "hcpcs_reference": QueryTemplate("""
+        SELECT hcpcs_code, category, description
+        FROM hiv_hcpcs_reference
+        ORDER BY category, hcpcs_code
+    """),
+
+    # ------------------------------------------------------------
+    # State Overview: the state x year cube, rolled up to one row per state
+    # ------------------------------------------------------------
+    "state_overview": QueryTemplate("""
+        SELECT state, year, billing_npis, total_claims, total_beneficiaries, total_paid
+        FROM state_year_summary
+        WHERE state IS NOT NULL
+        {filters}
+    """, filters={"states": "state", "years": "year"}, dimensions={"states": "state", "years": "year"},
+        rollup=f"""
+        SELECT
+            state,
+            {MERGED_PROVIDERS} AS total_providers,
+            SUM(total_claims) AS total_claims,
+            SUM(total_beneficiaries) AS total_beneficiaries,
+            ROUND(SUM(total_paid), 2) AS total_paid
+        FROM cube
+        GROUP BY 1
+        ORDER BY total_claims DESC
+    """),
+
+    # ------------------------------------------------------------
+    # HIV Services: a state x year x code cube, rolled up to the category,
+    # category x state and code tables in one GROUPING SETS pass;
+    # GROUPING(state, hcpcs_code) is 3, 1 and 2
+    # ------------------------------------------------------------
+    "hiv_services": QueryTemplate("""
+        SELECT
+            t.state,
+            t.year,
+            t.hcpcs_code,
+            t.hiv_category AS category,
+            h.description,
+            list_sort(LIST(DISTINCT t.billing_npi) FILTER (WHERE t.billing_npi IS NOT NULL)) AS billing_npis,
+            SUM(t.total_claims) AS total_claims,
+            SUM(t.total_beneficiaries) AS total_beneficiaries,
+            SUM(t.total_paid) AS total_paid
+        FROM {hiv_claims_rollup} t
+        LEFT JOIN hiv_hcpcs_reference h ON t.hcpcs_code = h.hcpcs_code
+        WHERE t.state IS NOT NULL
+        {filters}
+        GROUP BY 1, 2, 3, 4, 5
+    """, filters=ROLLUP_FILTERS, dimensions={"states": "state", "years": "year", "codes": "hcpcs_code"},
+        rollup=f"""
+        SELECT
+            GROUPING(state, hcpcs_code) AS grain,
+            category,
+            state,
+            hcpcs_code,
+            ANY_VALUE(description) AS description,
+            {MERGED_PROVIDERS} AS providers,
+            SUM(total_claims) AS total_claims,
+            SUM(total_beneficiaries) AS total_beneficiaries,
+            ROUND(SUM(total_paid), 2) AS total_paid
+        FROM cube
+        GROUP BY GROUPING SETS (
+            (category),
+            (category, state),
+            (hcpcs_code, category)
+        )
+        ORDER BY total_claims DESC
+    """),
+
+    # ------------------------------------------------------------
+    # Provider Directory: aggregate claims by NPI (or NPI pair) first, then
+    # join the much smaller result to provider_dim for display fields.
+    # Always rendered through render_page(), which adds search and order.
+    # Sums are cast to DOUBLE here, not by arrow_results, so the values the
+    # keyset cursor carries are exactly the values SQL sorts and compares.
+    # ------------------------------------------------------------
+    "directory_billing": QueryTemplate("""
+        WITH claims AS (
+            SELECT
+                t.billing_npi AS npi,
+                COUNT(DISTINCT t.hiv_category) AS hiv_service_categories,
+                STRING_AGG(DISTINCT t.hiv_category, ', ' ORDER BY t.hiv_category) AS categories_served,
+                CAST(SUM(t.total_claims) AS DOUBLE) AS total_hiv_claims,
+                CAST(SUM(t.total_beneficiaries) AS DOUBLE) AS total_beneficiaries,
+                ROUND(SUM(t.total_paid), 2) AS total_paid
+            FROM {hiv_claims_rollup} t
+            WHERE t.state IS NOT NULL
+            {filters}
+            GROUP BY 1
+        )
+        SELECT
+            c.npi,
+            p.entity_type,
+            p.billing_name AS provider_name,
+            p.credentials,
+            p.taxonomy,
+            p.address,
+            p.city,
+            p.state,
+            p.zip,
+            p.phone,
+            c.hiv_service_categories,
+            c.categories_served,
+            c.total_hiv_claims,
+            c.total_beneficiaries,
+            c.total_paid,
+            COALESCE(p.search_text, CAST(c.npi AS VARCHAR)) AS search_text
+        FROM claims c
+        LEFT JOIN provider_dim p ON c.npi = p.npi
+    """, filters=ROLLUP_FILTERS, keys=("npi",),
+        sort_columns={**DIRECTORY_SORTS, "provider_name": "", "city": ""}),
+
+    "directory_servicing": QueryTemplate("""
+        WITH claims AS (
+            SELECT
+                t.servicing_npi AS npi,
+                COUNT(DISTINCT t.hiv_category) AS hiv_service_categories,
+                STRING_AGG(DISTINCT t.hiv_category, ', ' ORDER BY t.hiv_category) AS categories_served,
+                CAST(SUM(t.total_claims) AS DOUBLE) AS total_hiv_claims,
+                CAST(SUM(t.total_beneficiaries) AS DOUBLE) AS total_beneficiaries,
+                ROUND(SUM(t.total_paid), 2) AS total_paid
+            FROM {hiv_claims_rollup} t
+            WHERE t.state IS NOT NULL
+            {filters}
+            GROUP BY 1
+        )
+        SELECT
+            c.npi,
+            p.entity_type,
+            COALESCE(p.provider_name, 'Unknown') AS provider_name,
+            p.credentials,
+            p.taxonomy,
+            p.address,
+            p.city,
+            p.state,
+            p.zip,
+            p.phone,
+            c.hiv_service_categories,
+            c.categories_served,
+            c.total_hiv_claims,
+            c.total_beneficiaries,
+            c.total_paid,
+            COALESCE(p.search_text, CAST(c.npi AS VARCHAR)) AS search_text
+        FROM claims c
+        LEFT JOIN provider_dim p ON c.npi = p.npi
+    """, filters=ROLLUP_FILTERS, keys=("npi",),
+        sort_columns={**DIRECTORY_SORTS, "provider_name": "", "city": ""}),
+
+    "directory_combined": QueryTemplate("""
+        WITH claims AS (
+            SELECT
+                t.billing_npi,
+                t.servicing_npi,
+                COUNT(DISTINCT t.hiv_category) AS hiv_service_categories,
+                STRING_AGG(DISTINCT t.hiv_category, ', ' ORDER BY t.hiv_category) AS categories_served,
+                CAST(SUM(t.total_claims) AS DOUBLE) AS total_hiv_claims,
+                CAST(SUM(t.total_beneficiaries) AS DOUBLE) AS total_beneficiaries,
+                ROUND(SUM(t.total_paid), 2) AS total_paid
+            FROM {hiv_claims_rollup} t
+            WHERE t.state IS NOT NULL
+            {filters}
+            GROUP BY 1, 2
+        )
+        SELECT
+            c.billing_npi,
+            b.billing_name,
+            b.entity_type AS billing_entity_type,
+            c.servicing_npi,
+            COALESCE(s.provider_name, 'Unknown') AS servicing_name,
+            s.credentials AS servicing_credentials,
+            s.taxonomy AS servicing_taxonomy,
+            b.city,
+            b.state,
+            b.zip,
+            c.hiv_service_categories,
+            c.categories_served,
+            c.total_hiv_claims,
+            c.total_beneficiaries,
+            c.total_paid,
+            concat_ws(' ',
+                COALESCE(b.search_text, CAST(c.billing_npi AS VARCHAR)),
+                COALESCE(s.search_text, CAST(c.servicing_npi AS VARCHAR))
+            ) AS search_text
+        FROM claims c
+        LEFT JOIN provider_dim b ON c.billing_npi = b.npi
+        LEFT JOIN provider_dim s ON c.servicing_npi = s.npi
+    """, filters=ROLLUP_FILTERS, keys=("billing_npi", "servicing_npi"),
+        sort_columns={**DIRECTORY_SORTS, "billing_name": "", "servicing_name": "", "city": ""}),
+
+    # ------------------------------------------------------------
+    # Trends: a state x month x category cube, rolled up to the month x
+    # category grain plus month- and year-level totals;
+    # GROUPING(month, category) is 0, 1 and 3
+    # ------------------------------------------------------------
+    "trends": QueryTemplate("""
+        SELECT
+            t.state,
+            t.year,
+            t.claim_month AS month,
+            t.hiv_category AS category,
+            list_sort(LIST(DISTINCT t.billing_npi) FILTER (WHERE t.billing_npi IS NOT NULL)) AS billing_npis,
+            SUM(t.total_claims) AS total_claims,
+            SUM(t.total_beneficiaries) AS total_beneficiaries,
+            SUM(t.total_paid) AS total_paid
+        FROM {hiv_claims_rollup} t
+        WHERE t.state IS NOT NULL
+        {filters}
+        GROUP BY 1, 2, 3, 4
+    """, filters={"states": "t.state", "years": "t.year"}, dimensions={"states": "state", "years": "year"},
+        rollup=f"""
+        SELECT
+            GROUPING(month, category) AS grain,
+            month,
+            MIN(year) AS year,
+            category,
+            {MERGED_PROVIDERS} AS providers,
+            SUM(total_claims) AS total_claims,
+            SUM(total_beneficiaries) AS total_beneficiaries,
+            ROUND(SUM(total_paid), 2) AS total_paid
+        FROM cube
+        GROUP BY GROUPING SETS (
+            (month, category),
+            (month),
+            (year)
+        )
+        ORDER BY month, year
+    """),
+}
+
+
+def normalize_filters(filters):
+    """Drop empty filters and dedupe/sort the rest so selection order never matters."""
+    return {name: sorted(set(values)) for name, values in filters.items() if values}
+
+
+def cache_key(template_id, filters):
+    """Hashable, order-independent key for a template and its filter values."""
+    normalized = normalize_filters(filters)
+    return template_id, tuple((name, tuple(values)) for name, values in sorted(normalized.items()))
+
+
+def widen(template_id, filters):
+    """Drop filters on the template's dimensions; the wider result can serve any subset."""
+    dimensions = TEMPLATES[template_id].dimensions
+    return {name: values for name, values in filters.items() if name not in dimensions}
+
+
+def render(template_id, filters, table_source=None):
+    """Return the SQL text and bound parameters for a template.
+
+    table_source(table, params), if given, returns the SQL to read each
+    table slot from.
+    """
+    template = TEMPLATES[template_id]
+    params = normalize_filters(filters)
+    unknown = set(params) - set(template.filters)
+    if unknown:
+        raise ValueError(f"Query '{template_id}' does not accept filters: {', '.join(sorted(unknown))}")
+
+    clauses = [
+        f"AND {column} IN (SELECT UNNEST(${name}))"
+        for name, column in template.filters.items()
+        if name in params
+    ]
+    sql = template.sql.replace("{filters}", "\n        ".join(clauses))
+    for table in TABLE_SLOTS:
+        sql = sql.replace("{" + table + "}", table_source(table, params) if table_source else table)
+    return sql, params
+
+
+def _literal(value):
+    return "'" + value.replace("'", "''") + "'" if isinstance(value, str) else repr(value)
+
+
+def _after(order, names):
+    """Predicate for rows strictly after the cursor $names in the given (expression, descending) order."""
+    (expr, descending), name = order[0], names[0]
+    after = f"{expr} {'<' if descending else '>'} ${name}"
+    if len(order) == 1:
+        return after
+    return f"({after} OR ({expr} = ${name} AND {_after(order[1:], names[1:])}))"
+
+
+def _sort_order(template, sort, descending):
+    """(expression, descending) pairs for a paged template; NULLs are replaced so the order is total."""
+    return [(f"COALESCE({sort}, {_literal(_sort_default(template, sort))})", descending)] + [
+        (f"COALESCE({key}, 0)", False) for key in template.keys
+    ]
+
+
+def _sort_default(template, sort):
+    return 0 if sort == RELEVANCE else template.sort_columns[sort]
+
+
+def search_terms(text):
+    """Split search text into the lowercase ASCII words and numbers search_text is made of."""
+    text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode().lower()
+    return re.findall(r"[a-z0-9]+", text)[:MAX_SEARCH_TERMS]
+
+
+def render_page(template_id, filters, search=None, category=None, sort=None, descending=True,
+                after=None, limit=None, table_source=None):
+    """Return the SQL text and bound parameters for one page of a paged template.
+
+    Every search_terms() word must occur in a row's search_text; sort may be
+    RELEVANCE when searching with the full-text index built. category is
+    matched against categories_served. after is the page_cursor() of the
+    previous page's last row (None for the first page). Each row carries the
+    PAGE_TOTALS columns. With limit=None every matching row is returned, in
+    order and without totals, for export.
+    """
+    template = TEMPLATES[template_id]
+    if not template.keys:
+        raise ValueError(f"Query '{template_id}' is not paged")
+    sort = sort or next(iter(template.sort_columns))
+    terms = search_terms(search)
+    if sort not in template.sort_columns and not (sort == RELEVANCE and terms):
+        raise ValueError(f"Query '{template_id}' cannot be sorted by '{sort}'")
+
+    inner, params = render(template_id, filters, table_source)
+    conditions = []
+    for i, term in enumerate(terms):
+        conditions.append(f"contains(search_text, $term_{i})")
+        params[f"term_{i}"] = term
+    if category:
+        conditions.append("list_contains(string_split(categories_served, ', '), $category)")
+        params["category"] = category
+
+    relevance = ""
+    if sort == RELEVANCE:
+        # Sum of each NPI's BM25 score against the provider_dim index
+        scores = " + ".join(
+            f"COALESCE({SEARCH_INDEX_SCHEMA}.match_bm25({key}, $search), 0)" for key in template.keys
+        )
+        relevance = f", {scores} AS {RELEVANCE}"
+        params["search"] = " ".join(terms)
+
+    order = _sort_order(template, sort, descending)
+    order_by = ", ".join(f"{expr} {'DESC' if desc else 'ASC'}" for expr, desc in order)
+    matched = f"""
+        WITH directory AS ({inner}),
+        matched AS (
+            SELECT * EXCLUDE (search_text){relevance}
+            FROM directory
+            WHERE {' AND '.join(conditions) or 'true'}
+        )"""
+    if limit is None:
+        columns = f"* EXCLUDE ({RELEVANCE})" if relevance else "*"
+        return f"{matched}\n        SELECT {columns} FROM matched ORDER BY {order_by}", params
+
+    names = [f"after_{i}" for i in range(len(order))]
+    if after is not None:
+        params.update(zip(names, after))
+    totals = ", ".join(f"{expr} AS {name}" for name, expr in PAGE_TOTALS.items())
+    sql = f"""{matched},
+        totals AS (SELECT {totals} FROM matched)
+        SELECT m.*, totals.*
+        FROM matched m, totals
+        WHERE {_after(order, names) if after is not None else 'true'}
+        ORDER BY {order_by}
+        LIMIT {int(limit)}
+    """
+    return sql, params
+
+
+def page_key(template_id, filters, **page):
+    """Hashable cache key for one render_page() result."""
+    options = tuple((name, tuple(value) if isinstance(value, list) else value) for name, value in sorted(page.items()))
+    return f"{template_id}:page", cache_key(template_id, filters)[1] + options
+
+
+def page_cursor(template_id, sort, row):
+    """Cursor to pass as render_page(after=...) for the page following row."""
+    template = TEMPLATES[template_id]
+    sort = sort or next(iter(template.sort_columns))
+    values = [(row[sort], _sort_default(template, sort))] + [(row[key], 0) for key in template.keys]
+    cursor = []
+    for value, default in values:
+        # DataFrames hand NULLs back as None or NaN, and numbers as numpy scalars
+        if value is None or value != value:
+            value = default
+        cursor.append(value.item() if hasattr(value, "item") else value)
+    return cursor
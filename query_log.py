@@ -0,0 +1,144 @@
+"""
+Query instrumentation: one JSON line per query through QueryRunner.
+
+Each ``query`` record holds the page, template ID, normalized filters, wall
+time, queue wait, rows and bytes returned, and whether the ResultCache
+answered it. A sample of queries runs under DuckDB's profiler, and the
+operator timings of those that were slow are logged as ``explain`` records
+(see QueryRunner). The log rotates by
+size; summary() and friends read every rotated file back with DuckDB for the
+admin Performance page.
+
+Settings: TMSIS_QUERY_LOG (path, default logs/queries.jsonl),
+TMSIS_SLOW_QUERY_MS (default 2000) and TMSIS_EXPLAIN_RATE (share of slow
+queries explained, default 0.1).
+"""
+import glob
+import json
+import logging
+import os
+import random
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+import duckdb
+
+LOG_PATH = Path(os.environ.get("TMSIS_QUERY_LOG", Path(__file__).parent / "logs" / "queries.jsonl"))
+
+# Every record field, so files where a field never appears still read the same
+COLUMNS = {
+    "ts": "VARCHAR",
+    "kind": "VARCHAR",
+    "page": "VARCHAR",
+    "template": "VARCHAR",
+    "filters": "VARCHAR",
+    "wall_ms": "DOUBLE",
+    "queue_ms": "DOUBLE",
+    "rows": "BIGINT",
+    "bytes": "BIGINT",
+    "cache": "VARCHAR",
+    "plan": "VARCHAR",
+}
+
+
+class QueryLog:
+    def __init__(self, path=LOG_PATH, max_bytes=10 * 2**20, backups=5, slow_ms=None, explain_rate=None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.slow_ms = float(os.environ.get("TMSIS_SLOW_QUERY_MS", 2000) if slow_ms is None else slow_ms)
+        self.explain_rate = float(os.environ.get("TMSIS_EXPLAIN_RATE", 0.1) if explain_rate is None else explain_rate)
+        self._logger = logging.getLogger(f"tmsis.query_log.{self.path}")
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        if not self._logger.handlers:
+            handler = RotatingFileHandler(self.path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger.addHandler(handler)
+
+    def query(self, page, template, filters, wall_ms, rows, nbytes, cache, queue_ms=None):
+        self._write(
+            kind="query", page=page, template=template, filters=filters, wall_ms=round(wall_ms, 2),
+            queue_ms=None if queue_ms is None else round(queue_ms, 2), rows=rows, bytes=nbytes, cache=cache,
+        )
+
+    def explain(self, page, template, filters, wall_ms, plan):
+        self._write(kind="explain", page=page, template=template, filters=filters, wall_ms=round(wall_ms, 2), plan=plan)
+
+    def should_profile(self):
+        """Decided before a query runs; its plan is logged only if is_slow() afterwards."""
+        return random.random() < self.explain_rate
+
+    def is_slow(self, wall_ms):
+        return wall_ms >= self.slow_ms
+
+    def _write(self, **record):
+        record["ts"] = datetime.now(timezone.utc).isoformat()
+        # Filters are stored as one canonical JSON string so identical combinations group together
+        record["filters"] = json.dumps(record["filters"], sort_keys=True, default=str)
+        self._logger.info(json.dumps(record, default=str))
+
+    # ------------------------------------------------------------
+    # Reading the log back
+    # ------------------------------------------------------------
+    def _read(self, sql, params=None):
+        files = sorted(glob.glob(f"{glob.escape(str(self.path))}*"))
+        if not files:
+            return None
+        conn = duckdb.connect()
+        try:
+            conn.execute(f"""
+                CREATE VIEW query_log AS
+                SELECT * FROM read_json(
+                    [{', '.join("'" + f.replace("'", "''") + "'" for f in files)}],
+                    format = 'newline_delimited',
+                    columns = {COLUMNS}
+                )
+            """)
+            return conn.execute(sql, params).to_arrow_table()
+        finally:
+            conn.close()
+
+    def summary(self):
+        """Per template: query count, cache hit rate, and warehouse (cache miss) latency percentiles."""
+        return self._read("""
+            SELECT
+                template,
+                COUNT(*) AS queries,
+                ROUND(AVG(CASE WHEN cache = 'miss' THEN 0.0 ELSE 1.0 END), 3) AS cache_hit_rate,
+                ROUND(quantile_cont(wall_ms, 0.50) FILTER (WHERE cache = 'miss'), 1) AS p50_ms,
+                ROUND(quantile_cont(wall_ms, 0.95) FILTER (WHERE cache = 'miss'), 1) AS p95_ms,
+                ROUND(quantile_cont(wall_ms, 0.99) FILTER (WHERE cache = 'miss'), 1) AS p99_ms,
+                ROUND(AVG(rows)) AS avg_rows,
+                ROUND(AVG(bytes)) AS avg_bytes
+            FROM query_log
+            WHERE kind = 'query'
+            GROUP BY template
+            ORDER BY p95_ms DESC NULLS LAST
+        """)
+
+    def slowest_filters(self, limit=25):
+        """Filter combinations whose warehouse queries are slowest at p95."""
+        return self._read("""
+            SELECT
+                template,
+                filters,
+                COUNT(*) AS queries,
+                ROUND(quantile_cont(wall_ms, 0.95), 1) AS p95_ms,
+                MAX(rows) AS max_rows
+            FROM query_log
+            WHERE kind = 'query' AND cache = 'miss'
+            GROUP BY template, filters
+            ORDER BY p95_ms DESC
+            LIMIT $limit
+        """, {"limit": limit})
+
+    def plans(self, limit=10):
+        """Most recent sampled query plans with operator timings."""
+        return self._read("""
+            SELECT ts, page, template, filters, wall_ms, plan
+            FROM query_log
+            WHERE kind = 'explain'
+            ORDER BY ts DESC
+            LIMIT $limit
+        """, {"limit": limit})
@@ -0,0 +1,288 @@
+"""
+Run dashboard queries concurrently, each on its own cursor, with admission
+control for busy periods.
+
+A DuckDB connection executes one statement at a time, so sessions (and a
+page's independent queries) sharing it used to queue behind each other.
+QueryRunner submits every query to a thread pool and runs it on a pooled
+cursor, a separate connection to the same database, so a page that submits
+its queries up front waits for the slowest one rather than the sum::
+
+    hiv = runner.submit("hiv_services", session=sid, states=states)
+    ref = runner.submit("hcpcs_reference", session=sid)
+    df_hiv, df_ref = hiv.result(), ref.result()
+
+Admission control:
+
+- at most ``max_workers`` queries run at once, each holding one pooled cursor;
+- at most ``max_queued`` wait behind them, beyond which submit() raises
+  AdmissionError instead of letting the backlog grow;
+- a session resubmitting a template it already has in flight (the user
+  changed a filter mid-query) cancels the older query, interrupting it if it
+  is running, and a session never has more than ``session_limit`` queries
+  in flight: its oldest is cancelled to make room.
+
+stats() reports queue depth, wait times and cancellation counts. Given a
+query_log.QueryLog, every query (cache hits included) is logged with its
+page, timings and size. A sample of queries runs with DuckDB's profiler on
+its own cursor, and the operator tree of those that turn out slow is logged,
+so a slow plan is never paid for twice.
+
+Results still go through the ResultCache; hits return an already completed
+future without touching the pool. At most every ``version_interval``
+seconds the runner reads dataset_metadata.data_version and hands it to the
+cache, which drops everything when the data has been rebuilt.
+
+Given a working_set.WorkingSet, the HIV templates run on a local cursor of
+that copy whenever it matches the data version, and fall back to a pooled
+warehouse cursor if the local query fails. A failed version check keeps the
+last known version, so HIV pages keep working through a warehouse outage.
+"""
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+
+import duckdb
+
+import arrow_results
+import dataset_metadata
+import queries
+import result_cache
+
+
+class AdmissionError(RuntimeError):
+    """The query queue is full."""
+
+
+class _Job:
+    def __init__(self, session, template_id, slot, log_fields):
+        self.session = session
+        self.template_id = template_id
+        self.slot = slot
+        self.log_fields = log_fields  # page, template and filters for the query log
+        self.submitted_at = time.monotonic()
+        self.future = None
+        self.cursor = None  # set while running
+        self.plan = None  # profiler output, for sampled queries
+        self.local = False  # running on the working set
+        self.cancelled = False
+
+
+def _done(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def _percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+class QueryRunner:
+    def __init__(self, conn, cache, table_source=None, max_workers=8, max_queued=64, session_limit=4,
+                 version_interval=60, log=None, working_set=None):
+        self.conn = conn
+        self.cache = cache
+        self.table_source = table_source
+        self.log = log
+        self.working_set = working_set
+        self.max_queued = max_queued
+        self.session_limit = session_limit
+        self.version_interval = version_interval
+        self._version_checked_at = None
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="query")
+        self._lock = threading.Lock()
+        self._idle_cursors = []
+        self._jobs = set()  # queued and running
+        self._waits = deque(maxlen=1000)  # seconds from submit to start, recent queries
+        self._counts = Counter()
+
+    def submit(self, template_id, session=None, page_name=None, **filters):
+        """Start a template query; returns a Future of its Arrow table."""
+        self._check_data_version()
+        log_fields = (page_name, template_id, queries.normalize_filters(filters))
+        start = time.perf_counter()
+        version = self.cache.data_version
+        table = self.cache.get(template_id, filters)
+        if table is not None:
+            self._log_query(log_fields, start, table, "hit")
+            return _done(table)
+        return self._admit(session, template_id, template_id, log_fields, self._run, template_id, filters, version)
+
+    def submit_page(self, template_id, filters, session=None, page_name=None, **options):
+        """Start a queries.render_page() query; returns a Future of the page's Arrow table."""
+        self._check_data_version()
+        key = queries.page_key(template_id, filters, **options)
+        logged_options = {name: value for name, value in options.items() if name != "after" and value}
+        log_fields = (page_name, key[0], {**queries.normalize_filters(filters), **logged_options})
+        start = time.perf_counter()
+        version = self.cache.data_version
+        table = self.cache.lookup(key)
+        if table is not None:
+            self._log_query(log_fields, start, table, "hit")
+            return _done(table)
+        return self._admit(session, template_id, key[0], log_fields, self._run_page, key, template_id, filters, options,
+                           version)
+
+    def run(self, template_id, session=None, **filters):
+        return self.submit(template_id, session=session, **filters).result()
+
+    def cancel(self, future):
+        """Cancel a queued query or interrupt a running one; a no-op once it has finished."""
+        with self._lock:
+            job = next((job for job in self._jobs if job.future is future), None)
+            if job is not None:
+                self._cancel(job)
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for job in self._jobs if job.cursor is not None)
+            waits = sorted(self._waits)
+            return {
+                "running": running,
+                "queued": len(self._jobs) - running,
+                "wait_p50_ms": round(_percentile(waits, 0.50) * 1000, 1),
+                "wait_p95_ms": round(_percentile(waits, 0.95) * 1000, 1),
+                "wait_max_ms": round((waits[-1] if waits else 0.0) * 1000, 1),
+                **self._counts,
+            }
+
+    def _check_data_version(self):
+        now = time.monotonic()
+        if self._version_checked_at is not None and now - self._version_checked_at < self.version_interval:
+            return
+        self._version_checked_at = now
+        try:
+            with self.conn.cursor() as cursor:
+                version = dataset_metadata.current_version(cursor)
+        except duckdb.Error:
+            # Warehouse unreachable: keep serving what the last known version allows
+            return
+        self.cache.set_data_version(version)
+        if self.working_set is not None:
+            self.working_set.refresh(version)
+
+    def _log_query(self, log_fields, start, table, cache, queue_s=None):
+        if self.log is None or table is None:
+            return
+        self.log.query(
+            *log_fields, wall_ms=(time.perf_counter() - start) * 1000, rows=table.num_rows, nbytes=table.nbytes,
+            cache=cache, queue_ms=None if queue_s is None else queue_s * 1000,
+        )
+
+    def _admit(self, session, template_id, slot, log_fields, fn, *args):
+        with self._lock:
+            queued = sum(1 for job in self._jobs if job.cursor is None)
+            if queued >= self.max_queued:
+                self._counts["rejected"] += 1
+                raise AdmissionError(f"{queued} queries already waiting")
+            if session is not None:
+                mine = sorted((job for job in self._jobs if job.session == session), key=lambda job: job.submitted_at)
+                stale = [job for job in mine if job.slot == slot]
+                live = [job for job in mine if job.slot != slot]
+                stale += live[:max(0, len(live) - self.session_limit + 1)]
+                for job in stale:
+                    self._cancel(job)
+            job = _Job(session, template_id, slot, log_fields)
+            self._jobs.add(job)
+            self._counts["submitted"] += 1
+            # Submitted under the lock so cancel() always finds job.future set
+            job.future = self._pool.submit(self._execute, job, fn, args)
+        return job.future
+
+    def _cancel(self, job):
+        # Called with self._lock held
+        if job.cancelled:
+            return
+        job.cancelled = True
+        if job.cursor is not None:
+            job.cursor.interrupt()
+            self._counts["interrupted"] += 1
+        elif job.future.cancel():
+            self._jobs.discard(job)
+            self._counts["cancelled"] += 1
+
+    def _warehouse_cursor(self):
+        # Called with self._lock held
+        return self._idle_cursors.pop() if self._idle_cursors else self.conn.cursor()
+
+    def _execute(self, job, fn, args):
+        local = self.working_set is not None and self.working_set.serves(job.template_id, self.cache.data_version)
+        with self._lock:
+            if job.cancelled:
+                self._jobs.discard(job)
+                raise CancelledError()
+            job.local = local
+            job.cursor = self.working_set.cursor() if local else self._warehouse_cursor()
+            queue_s = time.monotonic() - job.submitted_at
+            self._waits.append(queue_s)
+        profile = self.log is not None and self.log.should_profile()
+        try:
+            start = time.perf_counter()
+            try:
+                # The working set holds plain tables, so local queries never use table_source
+                table = self._run_on_cursor(job, fn, None if local else self.table_source, args, profile)
+            except duckdb.Error:
+                if not job.local or job.cancelled:
+                    raise
+                # The local copy couldn't answer (e.g. no full-text index); ask the warehouse
+                with self._lock:
+                    local_cursor, job.cursor = job.cursor, self._warehouse_cursor()
+                    job.local = False
+                    self._counts["local_fallbacks"] += 1
+                local_cursor.close()
+                table = self._run_on_cursor(job, fn, self.table_source, args, profile)
+            self._log_query(job.log_fields, start, table, "miss", queue_s)
+            wall_ms = (time.perf_counter() - start) * 1000
+            if job.plan is not None and self.log.is_slow(wall_ms):
+                self.log.explain(*job.log_fields, wall_ms=wall_ms, plan=job.plan)
+            return table
+        finally:
+            with self._lock:
+                cursor, job.cursor = job.cursor, None
+                self._jobs.discard(job)
+                self._counts["completed"] += 1
+                if job.local:
+                    self._counts["local"] += 1
+                elif not job.cancelled:
+                    self._idle_cursors.append(cursor)
+            if job.cancelled or job.local:
+                # Local cursors are cheap and not pooled; a cancelled one may still carry the interrupt
+                try:
+                    cursor.close()
+                except duckdb.Error:
+                    pass
+
+    def _run_on_cursor(self, job, fn, table_source, args, profile):
+        """fn on job.cursor; with profile, the profiler's tree of the query it ran is kept as job.plan."""
+        cursor = job.cursor
+        if not profile:
+            return fn(cursor, table_source, *args)
+        cursor.execute("PRAGMA enable_profiling = 'no_output'")
+        try:
+            table = fn(cursor, table_source, *args)
+            job.plan = cursor.get_profiling_information(format="query_tree")
+            return table
+        finally:
+            try:
+                cursor.execute("PRAGMA disable_profiling")
+            except duckdb.Error:
+                pass  # an interrupted cursor is closed rather than pooled
+
+    def _run(self, cursor, table_source, template_id, filters, version):
+        # Filters on a template's dimensions are dropped before querying, so
+        # the cached wider result can serve any selection by slicing.
+        # version is the data version at submit(); the cache drops the result
+        # if new data has been loaded since.
+        wide_filters = queries.widen(template_id, filters)
+        sql, params = queries.render(template_id, wide_filters, table_source=table_source)
+        table = arrow_results.fetch(cursor, sql, params)
+        self.cache.put(template_id, wide_filters, table, version)
+        return result_cache.narrow(template_id, wide_filters, table, filters)
+
+    def _run_page(self, cursor, table_source, key, template_id, filters, options, version):
+        sql, params = queries.render_page(template_id, filters, table_source=table_source, **options)
+        table = arrow_results.fetch(cursor, sql, params)
+        self.cache.store(key, table, version)
+        return table
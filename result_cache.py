@@ -0,0 +1,223 @@
+"""
+In-process result cache shared by every session.
+
+Entries are keyed by template ID and normalized filters. A request that
+misses exactly can still be served from a cached entry of the same template
+whose filters are a superset, as long as every narrowed filter is one of the
+template's ``dimensions``: the wider result is sliced to the requested rows.
+Slicing never merges rows, so distinct-count measures stay exact; filters on
+anything else must match exactly and otherwise go to the warehouse.
+
+For templates with a ``rollup`` the cached results are cubes, and the slice
+is then re-aggregated in-process (arrow_results.rollup), e.g. a years filter
+on State Overview sums the selected years' cells and merges their NPI lists.
+The rolled-up answers are kept too, under their own keys, so a repeated
+selection isn't rolled up again.
+
+Results that are never sliced, like Provider Directory pages, are stored and
+looked up by an exact key with store() and lookup().
+
+Results are pyarrow Tables (see arrow_results.py). Hits hand back the cached
+table itself and slices are filtered views of it, so nothing is pickled or
+copied per session.
+
+The cache is bounded by the byte size of the tables it holds (``max_bytes``)
+and evicts least recently used entries to stay under it. Entries don't
+expire on a timer: they stay valid until set_data_version() sees a new
+dataset_metadata.data_version, i.e. until build_tables.py loads new data.
+
+Given a result_store.ResultStore as ``disk``, a memory miss is next looked
+up there under the current data version: first the exact key, then the
+widened key (queries.widen) that warm_cache.py precomputes, sliced down.
+Results found on disk are kept in memory like any other.
+
+Every write names the data version its result was computed under, and is
+dropped if set_data_version() has moved on since: a query that was running
+when new data arrived must not repopulate the cache with the old rows.
+"""
+import threading
+from collections import Counter, OrderedDict
+
+import arrow_results
+import queries
+
+DEFAULT_MAX_BYTES = 512 * 2**20
+
+
+class ResultCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, disk=None):
+        self.max_bytes = max_bytes
+        self.disk = disk  # result_store.ResultStore, or None
+        self.data_version = None
+        # cache key -> (normalized filters, pyarrow Table, bytes); least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def get(self, template_id, filters):
+        """Return a cached or sliced result, or None if the warehouse must be asked."""
+        wanted = queries.normalize_filters(filters)
+        key = queries.cache_key(template_id, wanted)
+        template = queries.TEMPLATES[template_id]
+        answer_key = _rolled_up_key(key) if template.rollup else key
+        with self._lock:
+            version = self.data_version
+            entry = self._entries.get(answer_key)
+            if entry is not None:
+                self._entries.move_to_end(answer_key)
+                self._counts["hits"] += 1
+                return entry[1]
+            candidates = [
+                (cached_key, cached_filters, table)
+                for cached_key, (cached_filters, table, _) in self._entries.items()
+                if cached_key[0] == template_id
+            ]
+
+        for cached_key, cached_filters, table in candidates:
+            if _covers(cached_filters, wanted, template.dimensions):
+                with self._lock:
+                    if cached_key in self._entries:
+                        self._entries.move_to_end(cached_key)
+                    self._counts["slice_hits"] += 1
+                return self._answer(template_id, answer_key, table, cached_filters, wanted, version)
+        return self._load(template_id, answer_key, wanted, version)
+
+    def put(self, template_id, filters, table, data_version):
+        """Cache a template result computed under data_version."""
+        self._add(queries.cache_key(template_id, filters), queries.normalize_filters(filters), table, data_version)
+
+    def lookup(self, key):
+        with self._lock:
+            version = self.data_version
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._counts["hits"] += 1
+                return entry[1]
+        table = self._load_stored(key, version)
+        if table is None:
+            with self._lock:
+                self._counts["misses"] += 1
+            return None
+        self._add(key, None, table, version)
+        return table
+
+    def store(self, key, table, data_version):
+        # key[0] never names a template, so get() never slices these entries
+        self._add(key, None, table, data_version)
+
+    def set_data_version(self, version):
+        """Drop every entry if version differs from the one they were cached under; True if it did."""
+        with self._lock:
+            if version == self.data_version:
+                return False
+            if self.data_version is not None:
+                self._counts["invalidations"] += 1
+            self.data_version = version
+            self._entries.clear()
+            self._bytes = 0
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "resident_bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "data_version": self.data_version,
+                **self._counts,
+            }
+
+    def _load_stored(self, key, version):
+        if self.disk is None or version is None:
+            return None
+        table = self.disk.load(version, key)
+        if table is not None:
+            with self._lock:
+                self._counts["disk_hits"] += 1
+        return table
+
+    def _load(self, template_id, answer_key, wanted, version):
+        """Fall back to the disk store for a memory miss; None if it doesn't have it either."""
+        wide = queries.normalize_filters(queries.widen(template_id, wanted))
+        for filters in [wanted] + ([wide] if wide != wanted else []):
+            key = queries.cache_key(template_id, filters)
+            table = self._load_stored(key, version)
+            if table is not None:
+                self._add(key, filters, table, version)
+                return self._answer(template_id, answer_key, table, filters, wanted, version)
+        with self._lock:
+            self._counts["misses"] += 1
+        return None
+
+    def _answer(self, template_id, answer_key, table, cached, wanted, version):
+        """Slice a cached result down to wanted, rolling it up and keeping the answer if the template has a rollup."""
+        answer = _answer(template_id, table, cached, wanted)
+        if answer_key[0] != template_id:
+            self._add(answer_key, None, answer, version)
+        return answer
+
+    def _add(self, key, filters, table, version):
+        size = table.nbytes
+        with self._lock:
+            if version != self.data_version:
+                # Computed from data that has been replaced since
+                self._counts["stale_drops"] += 1
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            if size > self.max_bytes:
+                # Never worth evicting everything else for one result
+                self._counts["evictions"] += 1
+                return
+            self._entries[key] = (filters, table, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self._counts["evictions"] += 1
+
+
+def narrow(template_id, wide_filters, table, filters):
+    """Slice a result fetched for wide_filters (see queries.widen) down to filters, rolled up if need be."""
+    return _answer(template_id, table, queries.normalize_filters(wide_filters), queries.normalize_filters(filters))
+
+
+def _rolled_up_key(key):
+    # key[0] never names a template, so get() never slices these entries
+    return f"{key[0]}:rollup", key[1]
+
+
+def _answer(template_id, table, cached, wanted):
+    template = queries.TEMPLATES[template_id]
+    table = _slice(table, cached, wanted, template.dimensions)
+    return arrow_results.rollup(table, template.rollup) if template.rollup else table
+
+
+def _covers(cached, wanted, dimensions):
+    """True if the cached filters select a superset that can be sliced down to wanted."""
+    for name in set(cached) | set(wanted):
+        cached_values = cached.get(name)
+        wanted_values = wanted.get(name)
+        if cached_values == wanted_values:
+            continue
+        if name not in dimensions:
+            return False
+        # an absent cached filter means "all values"
+        if wanted_values is None or (cached_values is not None and not set(wanted_values) <= set(cached_values)):
+            return False
+    return True
+
+
+def _slice(table, cached, wanted, dimensions):
+    for name, values in wanted.items():
+        if cached.get(name) != values:
+            table = arrow_results.where(table, dimensions[name], values)
+    return table
@@ -0,0 +1,66 @@
+"""
+Persistent on-disk tier behind ResultCache.
+
+Results are Parquet files under ``<root>/<data_version>/<template>/`` named
+by a digest of their cache key, so every app process (and every restart)
+sees the same precomputed results. warm_cache.py fills the store before
+traffic arrives; the app only reads it. A result is written to a temp file
+and renamed into place, so a reader never sees a partial file.
+
+Results for an older data version are never read (the version is part of the
+path) and prune() deletes them once a newer version has been warmed.
+
+Settings: TMSIS_RESULT_STORE (root directory, default result_store/).
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+from pathlib import Path
+
+from pyarrow import parquet
+
+STORE_ROOT = Path(os.environ.get("TMSIS_RESULT_STORE", Path(__file__).parent / "result_store"))
+
+
+def _safe(name):
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", str(name))
+
+
+class ResultStore:
+    def __init__(self, root=STORE_ROOT):
+        self.root = Path(root)
+
+    def _path(self, version, key):
+        digest = hashlib.sha256(json.dumps(key, default=str).encode()).hexdigest()[:32]
+        return self.root / _safe(version) / _safe(key[0]) / f"{digest}.parquet"
+
+    def load(self, version, key):
+        """The stored Arrow table for a cache key under version, or None."""
+        try:
+            return parquet.read_table(self._path(version, key), memory_map=True)
+        except FileNotFoundError:
+            return None
+
+    def save(self, version, key, table):
+        path = self._path(version, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-", suffix=".parquet")
+        os.close(fd)
+        try:
+            parquet.write_table(table, tmp, compression="zstd")
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def prune(self, version):
+        """Delete every stored result not under version; returns the versions removed."""
+        if not self.root.exists():
+            return []
+        stale = [path for path in self.root.iterdir() if path.is_dir() and path.name != _safe(version)]
+        for path in stale:
+            shutil.rmtree(path, ignore_errors=True)
+        return [path.name for path in stale]
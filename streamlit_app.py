@@ -1,6 +1,20 @@
-import streamlit as st
+import os
+import uuid
+from concurrent.futures import TimeoutError as FutureTimeout
+
 import duckdb
-import pandas as pd
+import streamlit as st
+
+import arrow_results
+import backends
+import dataset_metadata
+import exports
+import queries
+from query_log import QueryLog
+from query_runner import AdmissionError, QueryRunner
+from result_cache import ResultCache
+from result_store import ResultStore
+from working_set import WorkingSet
 
 st.set_page_config(page_title="NASTAD TMSIS Dashboard", page_icon="🏥", layout="wide")
 
@@ -164,17 +178,156 @@ st.markdown("""
 # ============================================================
 # DATABASE CONNECTION
 # ============================================================
+# MotherDuck by default; set TMSIS_BACKEND to run on a local DuckDB file,
+# a Parquet export or generated data (see backends.py)
+@st.cache_resource
+def get_backend():
+    return backends.from_env(motherduck_token=lambda: st.secrets["motherduck"]["token"])
+
 @st.cache_resource
 def get_connection():
-    token = st.secrets["motherduck"]["token"]
-    conn = duckdb.connect(f"md:my_db?motherduck_token={token}")
-    return conn
+    return get_backend().connect()
+
+@st.cache_resource
+def get_result_cache():
+    # Memory budget in MB for cached results; entries live until the data version changes.
+    # Misses fall back to the results warm_cache.py stored on disk.
+    return ResultCache(max_bytes=int(os.environ.get("TMSIS_CACHE_MB", 512)) * 2**20, disk=ResultStore())
+
+@st.cache_resource
+def get_query_log():
+    return QueryLog()
+
+@st.cache_resource
+def get_working_set():
+    # HIV pages query a local copy of their tables when the warehouse is remote
+    # (TMSIS_LOCAL_HIV=0 turns it off); see working_set.py
+    if not get_backend().remote or os.environ.get("TMSIS_LOCAL_HIV", "1") == "0":
+        return None
+    return WorkingSet(get_connection())
+
+@st.cache_resource
+def get_query_runner():
+    # Bounded pool of cursors shared by every session; see query_runner.py
+    return QueryRunner(
+        get_connection(), get_result_cache(), table_source=get_backend().table_source,
+        log=get_query_log(), working_set=get_working_set(),
+    )
 
-conn = get_connection()
 
-@st.cache_data(ttl=3600)
-def run_query(query):
-    return conn.execute(query).df()
+def session_id():
+    return st.session_state.setdefault("session_id", uuid.uuid4().hex)
+
+
+def admit(submit, *args, **kwargs):
+    try:
+        return submit(*args, session=session_id(), page_name=st.session_state.get("nav"), **kwargs)
+    except AdmissionError:
+        st.warning("⏳ The dashboard is busy right now. Please try again in a moment.")
+        st.stop()
+
+
+def await_result(future):
+    """Wait for a query while letting Streamlit abandon this run when the user changes a filter."""
+    if future.done():
+        return future.result()
+    ticker = st.empty()
+    try:
+        while True:
+            try:
+                return future.result(timeout=0.2)
+            except FutureTimeout:
+                # Any element update is where Streamlit stops a superseded run
+                ticker.empty()
+    except BaseException:
+        get_query_runner().cancel(future)
+        raise
+
+# Results are cached on the template ID plus sorted filter values. Filters on a
+# template's dimensions are dropped before querying, so e.g. one State
+# Overview cube serves every state and year selection by slicing and rolling up.
+# submit_query() starts a query without waiting, so a page can issue its
+# independent queries together.
+def submit_query(template_id, **filters):
+    return admit(get_query_runner().submit, template_id, **filters)
+
+
+def run_query(template_id, **filters):
+    return await_result(submit_query(template_id, **filters))
+
+
+def run_page_query(template_id, filters, **page):
+    """One page of a paged template; see queries.render_page()."""
+    return await_result(admit(get_query_runner().submit_page, template_id, filters, **page))
+
+
+@st.cache_data(ttl=24 * 3600, show_spinner=False)
+def has_search_index(version):
+    """True if build_tables.py or ingest.py created the provider_dim full-text index for this data version."""
+    with get_connection().cursor() as cursor:
+        return cursor.execute(
+            "SELECT COUNT(*) FROM duckdb_schemas() WHERE schema_name = ?", [queries.SEARCH_INDEX_SCHEMA]
+        ).fetchone()[0] > 0
+
+
+def export_panel(label, stem, df=None, render=None):
+    """Format picker and a button that serializes df, or streams render()'s query, only when clicked."""
+    col_fmt, col_button = st.columns([1, 3])
+    fmt = col_fmt.selectbox("Export format", list(exports.FORMATS), key=f"{stem}_export_format", label_visibility="collapsed")
+    if col_button.button(f"Prepare {label} export", key=f"{stem}_export"):
+        try:
+            with st.spinner("Preparing export..."):
+                if render is None:
+                    data = exports.table_bytes(df, fmt)
+                else:
+                    conn = get_connection()
+                    sql, params = render()
+                    with conn.cursor() as cursor:
+                        data = exports.query_bytes(cursor, sql, params, fmt)
+        except exports.ExportTooLarge as error:
+            # Streamlit holds a download in memory, so big extracts are capped (TMSIS_EXPORT_MAX_MB)
+            st.warning(f"⚠️ {error}")
+            return
+        st.download_button(f"📥 Download {label} ({fmt})", data, exports.filename(stem, fmt), exports.FORMATS[fmt].mime)
+
+
+# Sidebar metadata is painted from the backend's snapshot file, so the first
+# render never waits on the warehouse. Once the query runner has seen a data
+# version the snapshot doesn't describe (a rebuild or ingest since it was
+# written), the sidebar switches to that version's dataset_metadata row. If the
+# warehouse can't be read, it keeps the last metadata it had, or the snapshot.
+@st.cache_data(show_spinner=False)
+def load_snapshot(path):
+    return dataset_metadata.read_snapshot(path)
+
+@st.cache_data(ttl=60, show_spinner=False)
+def current_data_version():
+    with get_connection().cursor() as cursor:
+        return dataset_metadata.current_version(cursor)
+
+@st.cache_data(ttl=24 * 3600, show_spinner=False)
+def load_metadata(version):
+    with get_connection().cursor() as cursor:
+        return dataset_metadata.fetch(cursor)
+
+@st.cache_resource
+def last_metadata():
+    return {}
+
+def sidebar_metadata():
+    snapshot_path = get_backend().metadata_snapshot
+    snapshot = load_snapshot(str(snapshot_path)) if snapshot_path else None
+    # The runner's last version check; None until the session's first query
+    version = get_result_cache().data_version
+    if snapshot and version in (None, snapshot["data_version"]):
+        return snapshot
+    last = last_metadata()
+    try:
+        last["metadata"] = load_metadata(version or current_data_version())
+    except duckdb.Error:
+        if not (last or snapshot):
+            raise
+    return last.get("metadata", snapshot)
 
 # ============================================================
 # SIDEBAR - Navigation and State Filter
@@ -193,68 +346,48 @@ st.sidebar.markdown(
 )
 st.sidebar.markdown("---")
 
+# The Performance page is only listed for ?admin=<TMSIS_ADMIN_KEY>
+is_admin = bool(os.environ.get("TMSIS_ADMIN_KEY")) and st.query_params.get("admin") == os.environ["TMSIS_ADMIN_KEY"]
+
 page = st.sidebar.radio(
     "Navigate",
-    ["ℹ️ About", "📋 HCPCS Reference", "🏠 State Overview", "🔬 HIV Services", "👩‍⚕️ Provider Directory", "📈 Trends"],
+    ["ℹ️ About", "📋 HCPCS Reference", "🏠 State Overview", "🔬 HIV Services", "👩‍⚕️ Provider Directory", "📈 Trends"]
+    + (["⏱️ Performance"] if is_admin else []),
+    key="nav",
 )
 
 st.sidebar.markdown("---")
 
-# Load states for filter
-states_df = run_query("""
-    SELECT DISTINCT "Provider Business Practice Location Address State Name" AS state
-    FROM tmsis_enriched
-    WHERE "Provider Business Practice Location Address State Name" IS NOT NULL
-    ORDER BY state
-""")
+metadata = sidebar_metadata()
 
 selected_states = st.sidebar.multiselect(
     "Filter by State(s)",
-    states_df["state"].tolist(),
+    metadata["states"],
     default=None,
     help="Leave empty to show all states"
 )
 
-# Load years for filter
-years_df = run_query("""
-    SELECT DISTINCT LEFT(CLAIM_FROM_MONTH, 4) AS year
-    FROM tmsis_enriched
-    WHERE CLAIM_FROM_MONTH IS NOT NULL
-    ORDER BY year
-""")
-
 selected_years = st.sidebar.multiselect(
     "Filter by Year(s)",
-    years_df["year"].tolist(),
+    metadata["years"],
     default=None,
-    help="Leave empty to show all years. Does not apply to Trends page."
+    help="Leave empty to show all years."
 )
 
-# Build WHERE clause helpers
-def state_filter(alias=""):
-    col = f'{alias}"Provider Business Practice Location Address State Name"' if alias else '"Provider Business Practice Location Address State Name"'
-    if selected_states:
-        state_list = ", ".join([f"'{s}'" for s in selected_states])
-        return f"AND {col} IN ({state_list})"
-    return ""
-
-def year_filter(alias=""):
-    col = f'{alias}CLAIM_FROM_MONTH' if alias else 'CLAIM_FROM_MONTH'
-    if selected_years:
-        year_list = ", ".join([f"'{y}'" for y in selected_years])
-        return f"AND LEFT({col}, 4) IN ({year_list})"
-    return ""
-
 st.sidebar.markdown("---")
 st.sidebar.markdown(
     '<p style="color: #68D2F2; font-size: 11px;">'
-    '<strong>Data:</strong> CMS T-MSIS 2018–2024<br>'
-    '<strong>Records:</strong> 227M enriched claims<br>'
-    '<strong>Updated:</strong> February 2026<br><br>'
+    f'<strong>Data:</strong> CMS T-MSIS {metadata["years"][0]}–{metadata["years"][-1]}<br>'
+    f'<strong>Records:</strong> {dataset_metadata.row_count_label(metadata)} enriched claims<br>'
+    f'<strong>Updated:</strong> {dataset_metadata.refreshed_label(metadata)}<br><br>'
     'Built by <strong>NASTAD</strong></p>',
     unsafe_allow_html=True
 )
 
+queue_stats = get_query_runner().stats()
+if queue_stats["queued"]:
+    st.sidebar.caption(f"⏳ {queue_stats['queued']} queries waiting (p95 wait {queue_stats['wait_p95_ms'] / 1000:.1f}s)")
+
 
 # ============================================================
 # PAGE 0: ABOUT
@@ -329,9 +462,10 @@ if page == "ℹ️ About":
     | **Hosting** | Streamlit Community Cloud | Free public hosting — no software install required for end users |
     | **Data Backup** | Cloudflare R2 | Object storage for raw data files |
 
-    All queries run **live** against the full dataset — nothing is pre-aggregated or sampled. When you 
-    filter by state or view the provider directory, MotherDuck processes the query across all 227 million 
-    records and returns results in seconds.
+    All queries run **live** against the full dataset — nothing is sampled. The HIV Services, Provider 
+    Directory, and Trends pages read an HIV claims rollup that is rebuilt from all 227 million records 
+    (one row per state, month, HCPCS code, and billing/servicing NPI pair) with every data refresh, so 
+    filtering by state returns results almost instantly.
 
     ---
 
@@ -347,7 +481,7 @@ if page == "ℹ️ About":
        including their NPI, organization name, address, and which HIV service categories they provide. 
        Use this for Ryan White provider network gap analysis.
     5. **Trends** — Track how HIV service utilization has changed over 2018–2024 in your jurisdiction
-    6. **Download CSV** — Every page includes a download button so you can export data for your own analysis
+    6. **Download** — Every page can export its data as CSV, Parquet, or Arrow IPC for your own analysis
 
     ---
 
@@ -392,34 +526,34 @@ elif page == "📋 HCPCS Reference":
     st.markdown("---")
 
     # Load the live table from MotherDuck
-    df_hcpcs = run_query("""
-        SELECT hcpcs_code, category, description
-        FROM hiv_hcpcs_reference
-        ORDER BY category, hcpcs_code
-    """)
+    df_hcpcs = run_query("hcpcs_reference")
 
     # Summary metrics
     col1, col2 = st.columns(2)
     col1.metric("Total HCPCS Codes", len(df_hcpcs))
-    col2.metric("Service Categories", df_hcpcs["category"].nunique())
+    col2.metric("Service Categories", len(arrow_results.distinct(df_hcpcs, "category")))
 
     st.markdown("---")
 
     # Category summary
     st.subheader("Codes by Category")
-    df_cat_count = df_hcpcs.groupby("category").size().reset_index(name="code_count").sort_values("code_count", ascending=False)
-    st.bar_chart(df_cat_count.set_index("category")["code_count"], use_container_width=True)
+    df_cat_count = (
+        df_hcpcs.group_by("category").aggregate([("hcpcs_code", "count")])
+        .select(["category", "hcpcs_code_count"])
+        .rename_columns(["category", "code_count"])
+    )
+    st.bar_chart(df_cat_count, x="category", y="code_count", use_container_width=True)
 
     st.markdown("---")
 
     # Category filter
     selected_category = st.selectbox(
         "Filter by Category",
-        ["All Categories"] + sorted(df_hcpcs["category"].unique().tolist())
+        ["All Categories"] + arrow_results.distinct(df_hcpcs, "category")
     )
 
     if selected_category != "All Categories":
-        df_display = df_hcpcs[df_hcpcs["category"] == selected_category]
+        df_display = arrow_results.where(df_hcpcs, "category", [selected_category])
     else:
         df_display = df_hcpcs
 
@@ -438,8 +572,7 @@ elif page == "📋 HCPCS Reference":
     )
 
     # Download
-    csv = df_hcpcs.to_csv(index=False)
-    st.download_button("📥 Download Full HCPCS Reference Table (CSV)", csv, "hiv_hcpcs_reference.csv", "text/csv")
+    export_panel("Full HCPCS Reference Table", "hiv_hcpcs_reference", df=df_hcpcs)
 
     st.markdown("---")
 
@@ -495,36 +628,23 @@ elif page == "🏠 State Overview":
     st.title("🏠 State Overview")
     st.markdown("All Medicaid claims aggregated by state from the full TMSIS dataset (2018–2024).")
 
-    df = run_query(f"""
-        SELECT
-            "Provider Business Practice Location Address State Name" AS state,
-            COUNT(DISTINCT BILLING_PROVIDER_NPI_NUM) AS total_providers,
-            SUM(TOTAL_CLAIMS) AS total_claims,
-            SUM(TOTAL_UNIQUE_BENEFICIARIES) AS total_beneficiaries,
-            ROUND(SUM(TOTAL_PAID), 2) AS total_paid
-        FROM tmsis_enriched
-        WHERE "Provider Business Practice Location Address State Name" IS NOT NULL
-        {state_filter()}
-        {year_filter()}
-        GROUP BY 1
-        ORDER BY total_claims DESC
-    """)
+    df = run_query("state_overview", states=selected_states, years=selected_years)
 
     # Active filters display
     filter_desc = []
     if selected_states:
         filter_desc.append(f"States: {', '.join(selected_states)}")
     if selected_years:
-        filter_desc.append(f"Years: {', '.join(selected_years)}")
+        filter_desc.append(f"Years: {', '.join(map(str, selected_years))}")
     if filter_desc:
         st.caption("Active filters: " + " | ".join(filter_desc))
 
     # Metrics row
     col1, col2, col3, col4 = st.columns(4)
     col1.metric("States", len(df))
-    col2.metric("Providers", f"{df['total_providers'].sum():,.0f}")
-    col3.metric("Total Claims", f"{df['total_claims'].sum():,.0f}")
-    col4.metric("Total Paid", f"${df['total_paid'].sum():,.2f}")
+    col2.metric("Providers", f"{arrow_results.total(df, 'total_providers'):,.0f}")
+    col3.metric("Total Claims", f"{arrow_results.total(df, 'total_claims'):,.0f}")
+    col4.metric("Total Paid", f"${arrow_results.total(df, 'total_paid'):,.2f}")
 
     st.markdown("---")
 
@@ -532,7 +652,7 @@ elif page == "🏠 State Overview":
     tab1, tab2 = st.tabs(["📊 Chart", "📋 Table"])
 
     with tab1:
-        st.bar_chart(df.set_index("state")["total_claims"], use_container_width=True)
+        st.bar_chart(df, x="state", y="total_claims", use_container_width=True)
 
     with tab2:
         st.dataframe(
@@ -548,8 +668,7 @@ elif page == "🏠 State Overview":
             }
         )
 
-    csv = df.to_csv(index=False)
-    st.download_button("📥 Download State Summary (CSV)", csv, "state_summary.csv", "text/csv")
+    export_panel("State Summary", "state_summary", df=df)
 
 
 # ============================================================
@@ -560,39 +679,36 @@ elif page == "🔬 HIV Services":
     st.markdown("Medicaid claims filtered to HIV-related HCPCS codes, organized by service category.")
 
     # Load HCPCS reference for filters
-    df_hcpcs_ref = run_query("SELECT hcpcs_code, category, description FROM hiv_hcpcs_reference ORDER BY category, hcpcs_code")
+    df_hcpcs_ref = run_query("hcpcs_reference")
 
     # Category filter
-    all_hiv_categories = sorted(df_hcpcs_ref["category"].unique().tolist())
+    all_hiv_categories = arrow_results.distinct(df_hcpcs_ref, "category")
     selected_hiv_cat = st.selectbox("Filter by HIV Service Category", ["All Categories"] + all_hiv_categories, key="hiv_svc_cat")
 
     # HCPCS code filter - dynamically updates based on category
     if selected_hiv_cat != "All Categories":
-        available_codes = df_hcpcs_ref[df_hcpcs_ref["category"] == selected_hiv_cat]
+        available_codes = arrow_results.where(df_hcpcs_ref, "category", [selected_hiv_cat])
     else:
         available_codes = df_hcpcs_ref
 
-    code_options = [f"{row['hcpcs_code']} — {row['description']}" for _, row in available_codes.iterrows()]
+    code_options = [f"{row['hcpcs_code']} — {row['description']}" for row in available_codes.to_pylist()]
     selected_code_labels = st.multiselect("Filter by HCPCS Code(s)", code_options, default=None, help="Leave empty to show all codes in the selected category.")
     selected_codes = [label.split(" — ")[0] for label in selected_code_labels]
 
-    # Build HCPCS SQL filter
-    def hcpcs_filter():
-        if selected_codes:
-            code_list = ", ".join([f"'{c}'" for c in selected_codes])
-            return f"AND t.HCPCS_CODE IN ({code_list})"
-        elif selected_hiv_cat != "All Categories":
-            cat_codes = available_codes["hcpcs_code"].tolist()
-            code_list = ", ".join([f"'{c}'" for c in cat_codes])
-            return f"AND t.HCPCS_CODE IN ({code_list})"
-        return ""
+    # HCPCS filter: explicit codes win, otherwise every code in the chosen category
+    if selected_codes:
+        hiv_codes = selected_codes
+    elif selected_hiv_cat != "All Categories":
+        hiv_codes = available_codes["hcpcs_code"].to_pylist()
+    else:
+        hiv_codes = []
 
     # Active filters display
     filter_desc = []
     if selected_states:
         filter_desc.append(f"States: {', '.join(selected_states)}")
     if selected_years:
-        filter_desc.append(f"Years: {', '.join(selected_years)}")
+        filter_desc.append(f"Years: {', '.join(map(str, selected_years))}")
     if selected_hiv_cat != "All Categories":
         filter_desc.append(f"Category: {selected_hiv_cat}")
     if selected_codes:
@@ -602,30 +718,20 @@ elif page == "🔬 HIV Services":
 
     st.markdown("---")
 
-    # Category summary
-    df_cat = run_query(f"""
-        SELECT
-            h.category,
-            COUNT(DISTINCT t.BILLING_PROVIDER_NPI_NUM) AS providers,
-            SUM(t.TOTAL_CLAIMS) AS total_claims,
-            SUM(t.TOTAL_UNIQUE_BENEFICIARIES) AS total_beneficiaries,
-            ROUND(SUM(t.TOTAL_PAID), 2) AS total_paid
-        FROM tmsis_enriched t
-        INNER JOIN hiv_hcpcs_reference h ON t.HCPCS_CODE = h.hcpcs_code
-        WHERE "Provider Business Practice Location Address State Name" IS NOT NULL
-        {state_filter("t.")}
-        {year_filter("t.")}
-        {hcpcs_filter()}
-        GROUP BY 1
-        ORDER BY total_claims DESC
-    """)
+    # Category, category x state and code tables come from one GROUPING SETS scan
+    df_hiv = run_query("hiv_services", states=selected_states, years=selected_years, codes=hiv_codes)
+
+    measure_cols = ["providers", "total_claims", "total_beneficiaries", "total_paid"]
+    df_cat = arrow_results.grain(df_hiv, 3, ["category"] + measure_cols)
+    df_cat_state = arrow_results.grain(df_hiv, 1, ["category", "state"] + measure_cols)
+    df_code = arrow_results.grain(df_hiv, 2, ["hcpcs_code", "category", "description"] + measure_cols)
 
     # Metrics
     col1, col2, col3, col4 = st.columns(4)
     col1.metric("Service Categories", len(df_cat))
-    col2.metric("HIV Providers", f"{df_cat['providers'].sum():,.0f}")
-    col3.metric("HIV Claims", f"{df_cat['total_claims'].sum():,.0f}")
-    col4.metric("HIV Paid", f"${df_cat['total_paid'].sum():,.2f}")
+    col2.metric("HIV Providers", f"{arrow_results.total(df_cat, 'providers'):,.0f}")
+    col3.metric("HIV Claims", f"{arrow_results.total(df_cat, 'total_claims'):,.0f}")
+    col4.metric("HIV Paid", f"${arrow_results.total(df_cat, 'total_paid'):,.2f}")
 
     st.markdown("---")
 
@@ -633,7 +739,7 @@ elif page == "🔬 HIV Services":
     tab1, tab2 = st.tabs(["📊 Chart", "📋 Table"])
 
     with tab1:
-        st.bar_chart(df_cat.set_index("category")["total_claims"], use_container_width=True)
+        st.bar_chart(df_cat, x="category", y="total_claims", use_container_width=True)
 
     with tab2:
         st.dataframe(
@@ -653,24 +759,6 @@ elif page == "🔬 HIV Services":
 
     # Category + State breakdown
     st.subheader("HIV Claims by Category and State")
-    df_cat_state = run_query(f"""
-        SELECT
-            h.category,
-            "Provider Business Practice Location Address State Name" AS state,
-            COUNT(DISTINCT t.BILLING_PROVIDER_NPI_NUM) AS providers,
-            SUM(t.TOTAL_CLAIMS) AS total_claims,
-            SUM(t.TOTAL_UNIQUE_BENEFICIARIES) AS total_beneficiaries,
-            ROUND(SUM(t.TOTAL_PAID), 2) AS total_paid
-        FROM tmsis_enriched t
-        INNER JOIN hiv_hcpcs_reference h ON t.HCPCS_CODE = h.hcpcs_code
-        WHERE "Provider Business Practice Location Address State Name" IS NOT NULL
-        {state_filter("t.")}
-        {year_filter("t.")}
-        {hcpcs_filter()}
-        GROUP BY 1, 2
-        ORDER BY total_claims DESC
-    """)
-
     st.dataframe(
         df_cat_state,
         use_container_width=True,
@@ -689,25 +777,6 @@ elif page == "🔬 HIV Services":
 
     # HCPCS Code detail
     st.subheader("Detail by HCPCS Code")
-    df_code = run_query(f"""
-        SELECT
-            h.hcpcs_code,
-            h.category,
-            h.description,
-            COUNT(DISTINCT t.BILLING_PROVIDER_NPI_NUM) AS providers,
-            SUM(t.TOTAL_CLAIMS) AS total_claims,
-            SUM(t.TOTAL_UNIQUE_BENEFICIARIES) AS total_beneficiaries,
-            ROUND(SUM(t.TOTAL_PAID), 2) AS total_paid
-        FROM tmsis_enriched t
-        INNER JOIN hiv_hcpcs_reference h ON t.HCPCS_CODE = h.hcpcs_code
-        WHERE "Provider Business Practice Location Address State Name" IS NOT NULL
-        {state_filter("t.")}
-        {year_filter("t.")}
-        {hcpcs_filter()}
-        GROUP BY 1, 2, 3
-        ORDER BY total_claims DESC
-    """)
-
     st.dataframe(
         df_code,
         use_container_width=True,
@@ -723,8 +792,7 @@ elif page == "🔬 HIV Services":
         }
     )
 
-    csv = df_code.to_csv(index=False)
-    st.download_button("📥 Download HIV Services Data (CSV)", csv, "hiv_services.csv", "text/csv")
+    export_panel("HIV Services Data", "hiv_services", df=df_code)
 
 
 # ============================================================
@@ -734,227 +802,181 @@ elif page == "👩‍⚕️ Provider Directory":
     st.title("👩‍⚕️ HIV Service Provider Directory")
     st.markdown("Searchable directory of Medicaid providers billing for HIV-related services. Use this for **Ryan White coordination** and **provider gap analysis**.")
 
-    if not selected_states:
-        st.warning("⚠️ Please select at least one state in the sidebar to load the provider directory. Loading all states at once would return too many results.")
-    else:
-        # View toggle
-        view_mode = st.radio(
-            "View by",
-            ["Billing Provider", "Servicing Provider", "Billing + Servicing Combined"],
-            horizontal=True,
-            help="Billing = organization submitting the claim. Servicing = individual clinician who delivered care."
-        )
-
-        # HCPCS category and code filters
-        df_hcpcs_ref_dir = run_query("SELECT hcpcs_code, category, description FROM hiv_hcpcs_reference ORDER BY category, hcpcs_code")
-        all_hiv_cats_dir = sorted(df_hcpcs_ref_dir["category"].unique().tolist())
-
-        col_f1, col_f2 = st.columns(2)
-        with col_f1:
-            selected_hiv_cat_dir = st.selectbox("Filter by HIV Service Category", ["All Categories"] + all_hiv_cats_dir, key="dir_cat")
-        with col_f2:
-            if selected_hiv_cat_dir != "All Categories":
-                avail_codes_dir = df_hcpcs_ref_dir[df_hcpcs_ref_dir["category"] == selected_hiv_cat_dir]
-            else:
-                avail_codes_dir = df_hcpcs_ref_dir
-            code_opts_dir = [f"{row['hcpcs_code']} — {row['description']}" for _, row in avail_codes_dir.iterrows()]
-            sel_code_labels_dir = st.multiselect("Filter by HCPCS Code(s)", code_opts_dir, default=None, key="dir_codes")
-            sel_codes_dir = [label.split(" — ")[0] for label in sel_code_labels_dir]
-
-        def hcpcs_filter_dir():
-            if sel_codes_dir:
-                code_list = ", ".join([f"'{c}'" for c in sel_codes_dir])
-                return f"AND t.HCPCS_CODE IN ({code_list})"
-            elif selected_hiv_cat_dir != "All Categories":
-                cat_codes = avail_codes_dir["hcpcs_code"].tolist()
-                code_list = ", ".join([f"'{c}'" for c in cat_codes])
-                return f"AND t.HCPCS_CODE IN ({code_list})"
-            return ""
-
-        with st.spinner("Loading provider directory..."):
-            if view_mode == "Billing Provider":
-                df_providers = run_query(f"""
-                    SELECT
-                        t.BILLING_PROVIDER_NPI_NUM AS npi,
-                        b.entity_type,
-                        COALESCE(b.org_name, b.first_name || ' ' || b.last_name) AS provider_name,
-                        b.credentials,
-                        b.taxonomy_1 AS taxonomy,
-                        b.address,
-                        b.city,
-                        b.state,
-                        b.zip,
-                        b.phone,
-                        COUNT(DISTINCT h.category) AS hiv_service_categories,
-                        STRING_AGG(DISTINCT h.category, ', ' ORDER BY h.category) AS categories_served,
-                        SUM(t.TOTAL_CLAIMS) AS total_hiv_claims,
-                        SUM(t.TOTAL_UNIQUE_BENEFICIARIES) AS total_beneficiaries,
-                        ROUND(SUM(t.TOTAL_PAID), 2) AS total_paid
-                    FROM tmsis_enriched t
-                    INNER JOIN hiv_hcpcs_reference h ON t.HCPCS_CODE = h.hcpcs_code
-                    LEFT JOIN npi_lookup b ON t.BILLING_PROVIDER_NPI_NUM = b.NPI
-                    WHERE t."Provider Business Practice Location Address State Name" IS NOT NULL
-                    {state_filter("t.")}
-                    {year_filter("t.")}
-                    {hcpcs_filter_dir()}
-                    GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9, 10
-                    ORDER BY total_hiv_claims DESC
-                """)
-
-            elif view_mode == "Servicing Provider":
-                df_providers = run_query(f"""
-                    SELECT
-                        t.SERVICING_PROVIDER_NPI_NUM AS npi,
-                        s.entity_type,
-                        COALESCE(
-                            CASE WHEN s.entity_type = '2' THEN s.org_name
-                                 ELSE s.first_name || ' ' || s.last_name END,
-                            'Unknown'
-                        ) AS provider_name,
-                        s.credentials,
-                        s.taxonomy_1 AS taxonomy,
-                        s.address,
-                        s.city,
-                        s.state,
-                        s.zip,
-                        s.phone,
-                        COUNT(DISTINCT h.category) AS hiv_service_categories,
-                        STRING_AGG(DISTINCT h.category, ', ' ORDER BY h.category) AS categories_served,
-                        SUM(t.TOTAL_CLAIMS) AS total_hiv_claims,
-                        SUM(t.TOTAL_UNIQUE_BENEFICIARIES) AS total_beneficiaries,
-                        ROUND(SUM(t.TOTAL_PAID), 2) AS total_paid
-                    FROM tmsis_enriched t
-                    INNER JOIN hiv_hcpcs_reference h ON t.HCPCS_CODE = h.hcpcs_code
-                    LEFT JOIN npi_lookup s ON t.SERVICING_PROVIDER_NPI_NUM = s.NPI
-                    WHERE t."Provider Business Practice Location Address State Name" IS NOT NULL
-                    {state_filter("t.")}
-                    {year_filter("t.")}
-                    {hcpcs_filter_dir()}
-                    GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9, 10
-                    ORDER BY total_hiv_claims DESC
-                """)
-
-            else:  # Billing + Servicing Combined
-                df_providers = run_query(f"""
-                    SELECT
-                        t.BILLING_PROVIDER_NPI_NUM AS billing_npi,
-                        COALESCE(b.org_name, b.first_name || ' ' || b.last_name) AS billing_name,
-                        b.entity_type AS billing_entity_type,
-                        t.SERVICING_PROVIDER_NPI_NUM AS servicing_npi,
-                        COALESCE(
-                            CASE WHEN s.entity_type = '2' THEN s.org_name
-                                 ELSE s.first_name || ' ' || s.last_name END,
-                            'Unknown'
-                        ) AS servicing_name,
-                        s.credentials AS servicing_credentials,
-                        s.taxonomy_1 AS servicing_taxonomy,
-                        b.city,
-                        b.state,
-                        b.zip,
-                        COUNT(DISTINCT h.category) AS hiv_service_categories,
-                        STRING_AGG(DISTINCT h.category, ', ' ORDER BY h.category) AS categories_served,
-                        SUM(t.TOTAL_CLAIMS) AS total_hiv_claims,
-                        SUM(t.TOTAL_UNIQUE_BENEFICIARIES) AS total_beneficiaries,
-                        ROUND(SUM(t.TOTAL_PAID), 2) AS total_paid
-                    FROM tmsis_enriched t
-                    INNER JOIN hiv_hcpcs_reference h ON t.HCPCS_CODE = h.hcpcs_code
-                    LEFT JOIN npi_lookup b ON t.BILLING_PROVIDER_NPI_NUM = b.NPI
-                    LEFT JOIN npi_lookup s ON t.SERVICING_PROVIDER_NPI_NUM = s.NPI
-                    WHERE t."Provider Business Practice Location Address State Name" IS NOT NULL
-                    {state_filter("t.")}
-                    {year_filter("t.")}
-                    {hcpcs_filter_dir()}
-                    GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9, 10
-                    ORDER BY total_hiv_claims DESC
-                """)
-
-        # Active filters display
-        filter_desc = []
-        if selected_states:
-            filter_desc.append(f"States: {', '.join(selected_states)}")
-        if selected_years:
-            filter_desc.append(f"Years: {', '.join(selected_years)}")
+    # View toggle
+    view_mode = st.radio(
+        "View by",
+        ["Billing Provider", "Servicing Provider", "Billing + Servicing Combined"],
+        horizontal=True,
+        help="Billing = organization submitting the claim. Servicing = individual clinician who delivered care."
+    )
+    dir_template = {
+        "Billing Provider": "directory_billing",
+        "Servicing Provider": "directory_servicing",
+        "Billing + Servicing Combined": "directory_combined",
+    }[view_mode]
+
+    # HCPCS category and code filters
+    df_hcpcs_ref_dir = run_query("hcpcs_reference")
+    all_hiv_cats_dir = arrow_results.distinct(df_hcpcs_ref_dir, "category")
+
+    col_f1, col_f2 = st.columns(2)
+    with col_f1:
+        selected_hiv_cat_dir = st.selectbox("Filter by HIV Service Category", ["All Categories"] + all_hiv_cats_dir, key="dir_cat")
+    with col_f2:
         if selected_hiv_cat_dir != "All Categories":
-            filter_desc.append(f"Category: {selected_hiv_cat_dir}")
-        if sel_codes_dir:
-            filter_desc.append(f"Codes: {', '.join(sel_codes_dir)}")
-        if filter_desc:
-            st.caption("Active filters: " + " | ".join(filter_desc))
-        col1, col2, col3, col4 = st.columns(4)
-        col1.metric("Providers", f"{len(df_providers):,.0f}")
-        col2.metric("Total HIV Claims", f"{df_providers['total_hiv_claims'].sum():,.0f}")
-        col3.metric("Beneficiaries Served", f"{df_providers['total_beneficiaries'].sum():,.0f}")
-        col4.metric("Total Paid", f"${df_providers['total_paid'].sum():,.2f}")
-
-        st.markdown("---")
-
-        # Category filter
-        cat_col = "categories_served"
-        all_categories = sorted(df_providers[cat_col].dropna().str.split(", ").explode().unique())
-        selected_category = st.selectbox("Filter by HIV Service Category", ["All"] + list(all_categories))
-
-        # Search box
+            avail_codes_dir = arrow_results.where(df_hcpcs_ref_dir, "category", [selected_hiv_cat_dir])
+        else:
+            avail_codes_dir = df_hcpcs_ref_dir
+        code_opts_dir = [f"{row['hcpcs_code']} — {row['description']}" for row in avail_codes_dir.to_pylist()]
+        sel_code_labels_dir = st.multiselect("Filter by HCPCS Code(s)", code_opts_dir, default=None, key="dir_codes")
+        sel_codes_dir = [label.split(" — ")[0] for label in sel_code_labels_dir]
+
+    if sel_codes_dir:
+        dir_codes = sel_codes_dir
+    elif selected_hiv_cat_dir != "All Categories":
+        dir_codes = avail_codes_dir["hcpcs_code"].to_pylist()
+    else:
+        dir_codes = []
+
+    dir_filters = queries.normalize_filters(dict(states=selected_states, years=selected_years, codes=dir_codes))
+
+    # Search, category and sort run in the warehouse; only the visible page comes back
+    sort_labels = {
+        "total_hiv_claims": "HIV Claims",
+        "total_beneficiaries": "Beneficiaries",
+        "total_paid": "Total Paid",
+        "hiv_service_categories": "# Categories",
+        "provider_name": "Provider Name",
+        "billing_name": "Billing Provider",
+        "servicing_name": "Servicing Provider",
+        "city": "City",
+        queries.RELEVANCE: "Best match",
+    }
+    col_s1, col_s2, col_s3, col_s4 = st.columns([3, 2, 2, 1])
+    with col_s1:
         search = st.text_input("🔍 Search providers (name, city, NPI)")
+    with col_s2:
+        selected_category = st.selectbox("Providers serving category", ["All"] + all_hiv_cats_dir)
+    with col_s3:
+        sort_options = list(queries.TEMPLATES[dir_template].sort_columns)
+        if queries.search_terms(search) and has_search_index(metadata["data_version"]):
+            sort_options.insert(0, queries.RELEVANCE)
+        sort_col = st.selectbox("Sort by", sort_options, format_func=sort_labels.get)
+    with col_s4:
+        page_size = st.selectbox("Rows per page", [50, 100, 250, 500], index=1)
+    descending = st.checkbox("Sort descending", value=sort_col not in ("provider_name", "billing_name", "servicing_name", "city"))
+
+    page_request = dict(
+        search=search.strip(),
+        category=None if selected_category == "All" else selected_category,
+        sort=sort_col,
+        descending=descending,
+    )
 
-        df_display = df_providers.copy()
+    # Keyset cursors of the pages before this one; reset when the query changes
+    dir_query = (dir_template, queries.cache_key(dir_template, dir_filters), tuple(page_request.items()), page_size)
+    if st.session_state.get("dir_query") != dir_query:
+        st.session_state["dir_query"] = dir_query
+        st.session_state["dir_cursors"] = [None]
+    dir_cursors = st.session_state["dir_cursors"]
 
-        if selected_category != "All":
-            df_display = df_display[df_display[cat_col].str.contains(selected_category, na=False)]
+    with st.spinner("Loading provider directory..."):
+        df_page = run_page_query(dir_template, dir_filters, after=dir_cursors[-1], limit=page_size, **page_request)
 
-        if search:
-            mask = df_display.apply(lambda row: search.lower() in str(row.values).lower(), axis=1)
-            df_display = df_display[mask]
+    # Active filters display
+    filter_desc = []
+    if selected_states:
+        filter_desc.append(f"States: {', '.join(selected_states)}")
+    if selected_years:
+        filter_desc.append(f"Years: {', '.join(map(str, selected_years))}")
+    if selected_hiv_cat_dir != "All Categories":
+        filter_desc.append(f"Category: {selected_hiv_cat_dir}")
+    if sel_codes_dir:
+        filter_desc.append(f"Codes: {', '.join(sel_codes_dir)}")
+    if filter_desc:
+        st.caption("Active filters: " + " | ".join(filter_desc))
 
-        st.markdown(f"**{len(df_display):,} providers found**")
+    totals = df_page.slice(0, 1).to_pylist()[0] if len(df_page) else dict.fromkeys(queries.PAGE_TOTALS, 0)
+    matched_rows = int(totals["matched_rows"])
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Providers", f"{matched_rows:,.0f}")
+    col2.metric("Total HIV Claims", f"{totals['matched_claims']:,.0f}")
+    col3.metric("Beneficiaries Served", f"{totals['matched_beneficiaries']:,.0f}")
+    col4.metric("Total Paid", f"${totals['matched_paid']:,.2f}")
 
-        # Column config based on view mode
-        if view_mode == "Billing + Servicing Combined":
-            col_config = {
-                "billing_npi": "Billing NPI",
-                "billing_name": "Billing Provider",
-                "billing_entity_type": "Billing Type",
-                "servicing_npi": "Servicing NPI",
-                "servicing_name": "Servicing Provider",
-                "servicing_credentials": "Credentials",
-                "servicing_taxonomy": "Taxonomy",
-                "city": "City",
-                "state": "State",
-                "zip": "ZIP",
-                "hiv_service_categories": st.column_config.NumberColumn("# Categories", format="%d"),
-                "categories_served": "HIV Categories Served",
-                "total_hiv_claims": st.column_config.NumberColumn("HIV Claims", format="%d"),
-                "total_beneficiaries": st.column_config.NumberColumn("Beneficiaries", format="%d"),
-                "total_paid": st.column_config.NumberColumn("Total Paid ($)", format="$%.2f"),
-            }
-        else:
-            col_config = {
-                "npi": "NPI",
-                "entity_type": "Entity Type",
-                "provider_name": "Provider Name",
-                "credentials": "Credentials",
-                "taxonomy": "Taxonomy",
-                "address": "Address",
-                "city": "City",
-                "state": "State",
-                "zip": "ZIP",
-                "phone": "Phone",
-                "hiv_service_categories": st.column_config.NumberColumn("# Categories", format="%d"),
-                "categories_served": "HIV Categories Served",
-                "total_hiv_claims": st.column_config.NumberColumn("HIV Claims", format="%d"),
-                "total_beneficiaries": st.column_config.NumberColumn("Beneficiaries", format="%d"),
-                "total_paid": st.column_config.NumberColumn("Total Paid ($)", format="$%.2f"),
-            }
+    st.markdown("---")
 
-        st.dataframe(
-            df_display,
-            use_container_width=True,
-            hide_index=True,
-            height=600,
-            column_config=col_config
-        )
+    df_display = arrow_results.drop(df_page, queries.PAGE_TOTALS)
+    page_cursor = queries.page_cursor(dir_template, sort_col, arrow_results.last_row(df_display)) if len(df_display) else None
+    df_display = arrow_results.drop(df_display, [queries.RELEVANCE])
+    first_row = (len(dir_cursors) - 1) * page_size
+    if matched_rows:
+        st.markdown(f"**{matched_rows:,} providers found** — showing {first_row + 1:,}–{first_row + len(df_display):,}")
+    else:
+        st.markdown("**0 providers found**")
+
+    # Column config based on view mode
+    if view_mode == "Billing + Servicing Combined":
+        col_config = {
+            "billing_npi": "Billing NPI",
+            "billing_name": "Billing Provider",
+            "billing_entity_type": "Billing Type",
+            "servicing_npi": "Servicing NPI",
+            "servicing_name": "Servicing Provider",
+            "servicing_credentials": "Credentials",
+            "servicing_taxonomy": "Taxonomy",
+            "city": "City",
+            "state": "State",
+            "zip": "ZIP",
+            "hiv_service_categories": st.column_config.NumberColumn("# Categories", format="%d"),
+            "categories_served": "HIV Categories Served",
+            "total_hiv_claims": st.column_config.NumberColumn("HIV Claims", format="%d"),
+            "total_beneficiaries": st.column_config.NumberColumn("Beneficiaries", format="%d"),
+            "total_paid": st.column_config.NumberColumn("Total Paid ($)", format="$%.2f"),
+        }
+    else:
+        col_config = {
+            "npi": "NPI",
+            "entity_type": "Entity Type",
+            "provider_name": "Provider Name",
+            "credentials": "Credentials",
+            "taxonomy": "Taxonomy",
+            "address": "Address",
+            "city": "City",
+            "state": "State",
+            "zip": "ZIP",
+            "phone": "Phone",
+            "hiv_service_categories": st.column_config.NumberColumn("# Categories", format="%d"),
+            "categories_served": "HIV Categories Served",
+            "total_hiv_claims": st.column_config.NumberColumn("HIV Claims", format="%d"),
+            "total_beneficiaries": st.column_config.NumberColumn("Beneficiaries", format="%d"),
+            "total_paid": st.column_config.NumberColumn("Total Paid ($)", format="$%.2f"),
+        }
+
+    st.dataframe(
+        df_display,
+        use_container_width=True,
+        hide_index=True,
+        height=600,
+        column_config=col_config
+    )
+
+    # Pager: Next pushes the last row's cursor, Previous pops it
+    col_p1, col_p2, col_p3 = st.columns([1, 1, 4])
+    col_p1.button("◀ Previous", disabled=len(dir_cursors) == 1, on_click=dir_cursors.pop)
+    col_p2.button(
+        "Next ▶",
+        disabled=first_row + len(df_display) >= matched_rows,
+        on_click=dir_cursors.append,
+        args=(page_cursor,),
+    )
+    col_p3.caption(f"Page {len(dir_cursors):,} of {max(1, -(-matched_rows // page_size)):,}")
 
-        csv = df_display.to_csv(index=False)
-        st.download_button("📥 Download Provider Directory (CSV)", csv, "provider_directory.csv", "text/csv")
+    # Exports stream every matching row, not just this page
+    if matched_rows:
+        export_panel("Provider Directory", "provider_directory", render=lambda: queries.render_page(
+            dir_template, dir_filters, table_source=get_backend().table_source, **page_request
+        ))
 
 
 # ============================================================
@@ -965,53 +987,15 @@ elif page == "📈 Trends":
     st.markdown("Track Medicaid HIV service utilization over time to identify trends in provider participation, claims volume, and beneficiary access.")
 
     if selected_years:
-        st.info("ℹ️ The **Year filter** does not apply to this page — all years are shown to display the full trend.")
-
-    # Monthly trends
-    df_monthly = run_query(f"""
-        SELECT
-            t.CLAIM_FROM_MONTH AS month,
-            COUNT(DISTINCT t.BILLING_PROVIDER_NPI_NUM) AS providers,
-            SUM(t.TOTAL_CLAIMS) AS total_claims,
-            SUM(t.TOTAL_UNIQUE_BENEFICIARIES) AS total_beneficiaries,
-            ROUND(SUM(t.TOTAL_PAID), 2) AS total_paid
-        FROM tmsis_enriched t
-        INNER JOIN hiv_hcpcs_reference h ON t.HCPCS_CODE = h.hcpcs_code
-        WHERE "Provider Business Practice Location Address State Name" IS NOT NULL
-        {state_filter("t.")}
-        GROUP BY 1
-        ORDER BY 1
-    """)
+        st.caption(f"Active filters: Years: {', '.join(map(str, selected_years))}")
 
-    # Yearly summary
-    df_yearly = run_query(f"""
-        SELECT
-            LEFT(t.CLAIM_FROM_MONTH, 4) AS year,
-            COUNT(DISTINCT t.BILLING_PROVIDER_NPI_NUM) AS providers,
-            SUM(t.TOTAL_CLAIMS) AS total_claims,
-            SUM(t.TOTAL_UNIQUE_BENEFICIARIES) AS total_beneficiaries,
-            ROUND(SUM(t.TOTAL_PAID), 2) AS total_paid
-        FROM tmsis_enriched t
-        INNER JOIN hiv_hcpcs_reference h ON t.HCPCS_CODE = h.hcpcs_code
-        WHERE "Provider Business Practice Location Address State Name" IS NOT NULL
-        {state_filter("t.")}
-        GROUP BY 1
-        ORDER BY 1
-    """)
+    # One scan returns the month x category grain plus month- and year-level totals
+    df_trend = run_query("trends", states=selected_states, years=selected_years)
 
-    # Category trends
-    df_cat_trend = run_query(f"""
-        SELECT
-            t.CLAIM_FROM_MONTH AS month,
-            h.category,
-            SUM(t.TOTAL_CLAIMS) AS total_claims
-        FROM tmsis_enriched t
-        INNER JOIN hiv_hcpcs_reference h ON t.HCPCS_CODE = h.hcpcs_code
-        WHERE "Provider Business Practice Location Address State Name" IS NOT NULL
-        {state_filter("t.")}
-        GROUP BY 1, 2
-        ORDER BY 1
-    """)
+    measure_cols = ["providers", "total_claims", "total_beneficiaries", "total_paid"]
+    df_monthly = arrow_results.grain(df_trend, 1, ["month"] + measure_cols)
+    df_yearly = arrow_results.grain(df_trend, 3, ["year"] + measure_cols)
+    df_cat_trend = arrow_results.grain(df_trend, 0, ["month", "category", "total_claims"])
 
     # Yearly table
     st.subheader("Yearly Summary")
@@ -1020,7 +1004,7 @@ elif page == "📈 Trends":
         use_container_width=True,
         hide_index=True,
         column_config={
-            "year": "Year",
+            "year": st.column_config.NumberColumn("Year", format="%d"),
             "providers": st.column_config.NumberColumn("Providers", format="%d"),
             "total_claims": st.column_config.NumberColumn("Claims", format="%d"),
             "total_beneficiaries": st.column_config.NumberColumn("Beneficiaries", format="%d"),
@@ -1031,24 +1015,94 @@ elif page == "📈 Trends":
     st.markdown("---")
 
     st.subheader("Monthly HIV-Related Medicaid Claims")
-    st.line_chart(df_monthly.set_index("month")["total_claims"], use_container_width=True)
+    st.line_chart(df_monthly, x="month", y="total_claims", use_container_width=True)
 
     st.markdown("---")
 
     st.subheader("Monthly Active HIV Service Providers")
-    st.line_chart(df_monthly.set_index("month")["providers"], use_container_width=True)
+    st.line_chart(df_monthly, x="month", y="providers", use_container_width=True)
 
     st.markdown("---")
 
     st.subheader("Monthly Beneficiaries Receiving HIV Services")
-    st.line_chart(df_monthly.set_index("month")["total_beneficiaries"], use_container_width=True)
+    st.line_chart(df_monthly, x="month", y="total_beneficiaries", use_container_width=True)
 
     st.markdown("---")
 
     st.subheader("Claims by HIV Service Category Over Time")
-    if not df_cat_trend.empty:
-        df_pivot = df_cat_trend.pivot_table(index="month", columns="category", values="total_claims", fill_value=0)
-        st.line_chart(df_pivot, use_container_width=True)
+    if len(df_cat_trend):
+        st.line_chart(df_cat_trend, x="month", y="total_claims", color="category", use_container_width=True)
+
+    export_panel("Trends Data", "hiv_trends", df=df_monthly)
+
+
+# ============================================================
+# PAGE 5: PERFORMANCE (admin only)
+# ============================================================
+elif page == "⏱️ Performance":
+    st.title("⏱️ Query Performance")
+    st.markdown("Latency of every query through the query layer, read from the rotating query log. Use it to find slow templates and filter combinations worth a rollup.")
+
+    query_log = get_query_log()
+    runner_stats = get_query_runner().stats()
+    cache_stats = get_result_cache().stats()
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Running / Queued", f"{runner_stats['running']} / {runner_stats['queued']}")
+    col2.metric("Queue Wait p95", f"{runner_stats['wait_p95_ms']:,.0f} ms")
+    col3.metric("Cache Resident", f"{cache_stats['resident_bytes'] / 2**20:,.1f} / {cache_stats['max_bytes'] / 2**20:,.0f} MB")
+    lookups = sum(cache_stats.get(name, 0) for name in ("hits", "slice_hits", "disk_hits", "misses"))
+    col4.metric("Cache Hit Rate", f"{(lookups - cache_stats.get('misses', 0)) / lookups:.0%}" if lookups else "–")
+
+    working_set = get_working_set()
+    with st.expander("Runner and cache counters"):
+        st.json({
+            "runner": runner_stats,
+            "cache": cache_stats,
+            "working_set_version": working_set.version if working_set else None,
+        })
+
+    st.markdown("---")
+
+    df_summary = query_log.summary()
+    if df_summary is None:
+        st.info(f"No queries logged yet at `{query_log.path}`.")
+    else:
+        st.subheader("Latency by Query Template")
+        st.caption("Percentiles cover warehouse queries (cache misses); the hit rate covers every request.")
+        st.dataframe(
+            df_summary,
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "template": "Template",
+                "queries": st.column_config.NumberColumn("Queries", format="%d"),
+                "cache_hit_rate": st.column_config.NumberColumn("Cache Hit Rate", format="%.3f"),
+                "p50_ms": st.column_config.NumberColumn("p50 (ms)", format="%.1f"),
+                "p95_ms": st.column_config.NumberColumn("p95 (ms)", format="%.1f"),
+                "p99_ms": st.column_config.NumberColumn("p99 (ms)", format="%.1f"),
+                "avg_rows": st.column_config.NumberColumn("Avg Rows", format="%d"),
+                "avg_bytes": st.column_config.NumberColumn("Avg Bytes", format="%d"),
+            }
+        )
+
+        st.subheader("Slowest Filter Combinations")
+        st.dataframe(
+            query_log.slowest_filters(),
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "template": "Template",
+                "filters": "Filters",
+                "queries": st.column_config.NumberColumn("Queries", format="%d"),
+                "p95_ms": st.column_config.NumberColumn("p95 (ms)", format="%.1f"),
+                "max_rows": st.column_config.NumberColumn("Max Rows", format="%d"),
+            }
+        )
 
-    csv = df_monthly.to_csv(index=False)
-    st.download_button("📥 Download Trends Data (CSV)", csv, "hiv_trends.csv", "text/csv")
+        st.subheader("Sampled Query Plans")
+        st.caption(f"A {query_log.explain_rate:.0%} sample of queries slower than {query_log.slow_ms:,.0f} ms.")
+        for plan in query_log.plans().to_pylist():
+            with st.expander(f"{plan['template']} — {plan['wall_ms']:,.0f} ms — {plan['ts']}"):
+                st.caption(f"Page: {plan['page']} | Filters: {plan['filters']}")
+                st.code(plan["plan"], language=None)
@@ -0,0 +1,134 @@
+"""
+Synthetic stand-ins for tmsis_enriched, npi_lookup and hiv_hcpcs_reference
+with the real column names and types, for running the dashboard without
+network access or secrets.
+
+Values come from hashing the row number with a seed rather than random(),
+so the same rows/seed produce the same data regardless of thread count.
+Distributions are skewed roughly like the real data: a few large states,
+a heavy-tailed NPI distribution and HIV codes on a small share of rows.
+"""
+STATE_WEIGHTS = {
+    "CA": 120, "NY": 90, "TX": 70, "FL": 55, "PA": 40, "IL": 38, "OH": 35, "MI": 30,
+    "NC": 28, "GA": 26, "NJ": 25, "WA": 22, "MA": 22, "AZ": 20, "VA": 18, "TN": 17,
+    "IN": 16, "MO": 15, "MD": 15, "WI": 14, "MN": 14, "CO": 14, "LA": 13, "KY": 13,
+    "OR": 12, "SC": 12, "AL": 11, "OK": 10, "CT": 10, "PR": 10, "IA": 8, "AR": 8,
+    "MS": 8, "KS": 7, "NV": 7, "UT": 7, "NM": 7, "WV": 6, "NE": 5, "ID": 4,
+    "HI": 4, "ME": 4, "NH": 3, "RI": 3, "MT": 3, "DE": 3, "DC": 3, "SD": 2,
+    "ND": 2, "AK": 2, "VT": 2, "WY": 1, "GU": 1, "VI": 1, "AS": 1, "MP": 1,
+}
+
+HIV_CODES = {
+    "HIV Screening & Diagnosis": [
+        "86689", "86701", "86702", "86703", "87389", "87390", "87391", "87534",
+        "87535", "87806", "G0432", "G0433", "G0435", "G0475",
+    ],
+    "HIV Lab Monitoring": [
+        "86359", "86360", "86361", "87536", "87537", "87538", "87539", "87900",
+        "87901", "87903", "87904", "87906",
+    ],
+    "Antiretroviral Therapy": ["J0741", "J1746", "J1961"],
+    "PrEP": [
+        "J0739", "J0750", "J0751", "G0011", "G0012", "G0013", "Q0516", "Q0517",
+        "Q0518", "Q0519", "Q0520", "Q0521",
+    ],
+    "OI Prophylaxis & Treatment": [
+        "J2545", "S0080", "J0285", "J0287", "J0288", "J0289", "J1570", "J1455",
+        "J0740", "J2248", "J0637", "J1835",
+    ],
+    "HIV Quality Measure": ["G9242", "G9243", "G9244", "G9245", "G9246", "G9247", "G8500"],
+    "HIV Supportive Services": ["S9560", "S9562", "S9563", "S9364", "S9365", "S9366", "S9368"],
+}
+
+FIRST_NAMES = ["Maria", "James", "Aisha", "Wei", "Carlos", "Priya", "John", "Fatima", "David", "Keisha"]
+LAST_NAMES = ["Garcia", "Smith", "Johnson", "Nguyen", "Williams", "Patel", "Brown", "Kim", "Lopez", "Davis"]
+ORG_WORDS = ["Community", "Health", "Family", "Regional", "Unity", "Hope", "Valley", "Metro"]
+TAXONOMIES = ["207Q00000X", "207R00000X", "208D00000X", "261QF0400X", "363L00000X", "333600000X", "291U00000X"]
+
+HIV_SHARE = 0.005      # share of claim rows billed under an HIV code
+NON_HIV_CODES = 2000   # size of the non-HIV HCPCS pool
+MONTHS = 84            # January 2018 through December 2024
+
+
+def _sql_list(values):
+    return "[" + ", ".join("'" + v.replace("'", "''") + "'" for v in values) + "]"
+
+
+def _weighted_slots(weights, slots=1000):
+    """Repeat each key in proportion to its weight so a uniform index picks by weight."""
+    total = sum(weights.values())
+    out = []
+    for key, weight in weights.items():
+        out.extend([key] * max(1, round(slots * weight / total)))
+    return out
+
+
+def generate(conn, rows=1_000_000, seed=0, npis=None):
+    """Create tmsis_enriched, npi_lookup and hiv_hcpcs_reference on conn."""
+    npis = npis or max(1_000, rows // 200)
+    state_slots = _weighted_slots(STATE_WEIGHTS)
+
+    # rnd(i, k): uniform [0, 1) from row i and stream k
+    conn.execute(f"CREATE OR REPLACE TEMP MACRO rnd(i, k) AS (hash(i, k, {int(seed)}) % 1000000007) / 1000000007.0")
+
+    reference_rows = [
+        (code, category, f"{category} ({code})")
+        for category, codes in HIV_CODES.items()
+        for code in codes
+    ]
+    conn.execute("CREATE OR REPLACE TABLE hiv_hcpcs_reference (hcpcs_code VARCHAR, category VARCHAR, description VARCHAR)")
+    conn.executemany("INSERT INTO hiv_hcpcs_reference VALUES (?, ?, ?)", reference_rows)
+    hiv_codes = [code for code, _, _ in reference_rows]
+
+    conn.execute(f"""
+        CREATE OR REPLACE TABLE npi_lookup AS
+        SELECT
+            CAST(1000000000 + i AS VARCHAR) AS NPI,
+            CASE WHEN rnd(i, 1) < 0.3 THEN '2' ELSE '1' END AS entity_type,
+            CASE WHEN rnd(i, 1) < 0.3
+                 THEN {_sql_list(ORG_WORDS)}[1 + CAST(floor(rnd(i, 2) * {len(ORG_WORDS)}) AS INTEGER)] || ' Clinic ' || i
+            END AS org_name,
+            CASE WHEN rnd(i, 1) >= 0.3
+                 THEN {_sql_list(FIRST_NAMES)}[1 + CAST(floor(rnd(i, 3) * {len(FIRST_NAMES)}) AS INTEGER)]
+            END AS first_name,
+            CASE WHEN rnd(i, 1) >= 0.3
+                 THEN {_sql_list(LAST_NAMES)}[1 + CAST(floor(rnd(i, 4) * {len(LAST_NAMES)}) AS INTEGER)]
+            END AS last_name,
+            CASE WHEN rnd(i, 1) >= 0.3 THEN 'MD' END AS credentials,
+            {_sql_list(TAXONOMIES)}[1 + CAST(floor(rnd(i, 5) * {len(TAXONOMIES)}) AS INTEGER)] AS taxonomy_1,
+            (100 + i % 9900) || ' Main St' AS address,
+            'City ' || (i % 500) AS city,
+            {_sql_list(state_slots)}[1 + CAST(floor(rnd(i, 6) * {len(state_slots)}) AS INTEGER)] AS state,
+            printf('%05d', CAST(floor(rnd(i, 7) * 99999) AS INTEGER)) AS zip,
+            printf('555%07d', i % 10000000) AS phone
+        FROM range({int(npis)}) r(i)
+    """)
+
+    # Billing and servicing NPIs are drawn with a power-law skew so a few
+    # providers bill most rows; the claim's state is the billing NPI's state.
+    conn.execute(f"""
+        CREATE OR REPLACE TABLE tmsis_enriched AS
+        WITH claims AS (
+            SELECT
+                i,
+                CAST(floor(pow(rnd(i, 11), 2.5) * {int(npis)}) AS BIGINT) AS billing_idx,
+                CAST(floor(pow(rnd(i, 12), 2.5) * {int(npis)}) AS BIGINT) AS servicing_idx,
+                CASE WHEN rnd(i, 13) < {HIV_SHARE}
+                     THEN {_sql_list(hiv_codes)}[1 + CAST(floor(pow(rnd(i, 14), 2) * {len(hiv_codes)}) AS INTEGER)]
+                     ELSE printf('%05d', 10000 + CAST(floor(pow(rnd(i, 14), 2) * {NON_HIV_CODES}) AS INTEGER))
+                END AS hcpcs_code,
+                12 + CAST(floor(-ln(1 - rnd(i, 15)) * 40) AS BIGINT) AS total_claims
+            FROM range({int(rows)}) r(i)
+        )
+        SELECT
+            CAST(1000000000 + c.billing_idx AS VARCHAR) AS BILLING_PROVIDER_NPI_NUM,
+            CAST(1000000000 + c.servicing_idx AS VARCHAR) AS SERVICING_PROVIDER_NPI_NUM,
+            c.hcpcs_code AS HCPCS_CODE,
+            strftime(DATE '2018-01-01' + to_months(CAST(floor(rnd(c.i, 16) * {MONTHS}) AS INTEGER)), '%Y-%m') AS CLAIM_FROM_MONTH,
+            GREATEST(1, c.total_claims // (1 + CAST(floor(rnd(c.i, 17) * 4) AS BIGINT))) AS TOTAL_UNIQUE_BENEFICIARIES,
+            c.total_claims AS TOTAL_CLAIMS,
+            ROUND(c.total_claims * (5 + rnd(c.i, 18) * 120), 2) AS TOTAL_PAID,
+            n.state AS "Provider Business Practice Location Address State Name"
+        FROM claims c
+        JOIN npi_lookup n ON n.NPI = CAST(1000000000 + c.billing_idx AS VARCHAR)
+    """)
@@ -0,0 +1,29 @@
+import sys
+from pathlib import Path
+
+import duckdb
+import pytest
+
+# The dashboard modules are flat files at the repo root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import build_tables  # noqa: E402
+import synthetic_data  # noqa: E402
+
+ROWS = 20_000
+
+
+@pytest.fixture
+def raw_conn():
+    """In-memory database holding only the synthetic raw tables."""
+    conn = duckdb.connect()
+    synthetic_data.generate(conn, rows=ROWS, seed=1)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def built_conn(raw_conn):
+    """raw_conn after a full build_tables.build_all()."""
+    build_tables.build_all(raw_conn, log=None)
+    return raw_conn
@@ -0,0 +1,23 @@
+import build_tables
+from conftest import ROWS
+
+
+def test_build_all_creates_every_table(built_conn):
+    for name, _ in build_tables.BUILD_STEPS:
+        assert built_conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0] > 0
+    assert built_conn.execute("SELECT COUNT(*) FROM tmsis_claims").fetchone()[0] == ROWS
+
+
+def test_rollup_matches_hiv_claims(built_conn):
+    claims, rollup = built_conn.execute("""
+        SELECT
+            (SELECT SUM(t.TOTAL_CLAIMS) FROM tmsis_enriched t
+             JOIN hiv_hcpcs_reference h ON t.HCPCS_CODE = h.hcpcs_code),
+            (SELECT SUM(total_claims) FROM hiv_claims_rollup)
+    """).fetchone()
+    assert claims == rollup
+
+
+def test_metadata_has_a_data_version(built_conn):
+    version = built_conn.execute("SELECT data_version FROM dataset_metadata").fetchone()[0]
+    assert version
@@ -0,0 +1,19 @@
+import pytest
+
+import dataset_metadata
+
+
+def test_snapshot_round_trips_the_table(built_conn, tmp_path):
+    path = tmp_path / "dataset_metadata.json"
+    assert dataset_metadata.read_snapshot(path) is None
+    meta = dataset_metadata.fetch(built_conn)
+    dataset_metadata.write_snapshot(meta, path)
+    assert dataset_metadata.read_snapshot(path) == meta
+
+
+@pytest.mark.parametrize("count, label", [
+    (0, "0"), (812, "812"), (20_000, "20K"), (412_345, "412.3K"),
+    (999_960, "1M"), (227_412_345, "227.4M"), (1_250_000_000, "1.2B"),
+])
+def test_row_count_label_scales_with_the_dataset(count, label):
+    assert dataset_metadata.row_count_label({"row_count": count}) == label
@@ -0,0 +1,22 @@
+import pytest
+from pyarrow import parquet
+
+import exports
+import queries
+
+
+@pytest.mark.parametrize("fmt", list(exports.FORMATS))
+def test_query_export_matches_the_query(built_conn, fmt, tmp_path):
+    sql, params = queries.render_page("directory_billing", {}, limit=None)
+    data = exports.query_bytes(built_conn, sql, params, fmt)
+    assert data
+    if fmt == "Parquet":
+        path = tmp_path / exports.filename("directory", fmt)
+        path.write_bytes(data)
+        assert parquet.read_table(path).num_rows == len(built_conn.execute(sql, params).fetchall())
+
+
+def test_export_over_the_cap_is_refused(built_conn):
+    sql, params = queries.render_page("directory_billing", {}, limit=None)
+    with pytest.raises(exports.ExportTooLarge):
+        exports.query_bytes(built_conn, sql, params, "CSV", max_bytes=1024)
@@ -0,0 +1,77 @@
+import pytest
+
+import build_tables
+import dataset_metadata
+import ingest
+from query_runner import QueryRunner
+from result_cache import ResultCache
+
+NEW_MONTH = "2030-01"
+MOVED_NPIS = 5
+RAW_TABLES = ("tmsis_enriched", "npi_lookup", "hiv_hcpcs_reference")
+DERIVED_TABLES = ("tmsis_claims", "hiv_claims_rollup", "state_year_summary", "provider_dim")
+
+
+@pytest.fixture
+def release(built_conn, tmp_path):
+    """A T-MSIS release with one new month (one month's rows, restamped) and an NPPES refresh moving NPIs to TX."""
+    tmsis = tmp_path / "release.csv"
+    columns = [f"'{NEW_MONTH}' AS {c}" if c == "CLAIM_FROM_MONTH" else c for c in ingest.TMSIS_COLUMNS]
+    built_conn.execute(f"""
+        COPY (SELECT {", ".join(columns)} FROM tmsis_enriched WHERE CLAIM_FROM_MONTH = '2019-01')
+        TO '{tmsis}' (HEADER)
+    """)
+    nppes = tmp_path / "nppes.csv"
+    headers = [
+        f"""'TX' AS "{header}\"""" if name == "state" else f'{name} AS "{header}"'
+        for name, header in ingest.NPPES_COLUMNS.items()
+    ]
+    built_conn.execute(f"""
+        COPY (
+            SELECT {", ".join(headers)} FROM npi_lookup
+            WHERE state <> 'TX' AND NPI IN (SELECT BILLING_PROVIDER_NPI_NUM FROM tmsis_enriched)
+            ORDER BY NPI LIMIT {MOVED_NPIS}
+        ) TO '{nppes}' (HEADER)
+    """)
+    return [str(tmsis)], [str(nppes)]
+
+
+def _rows(conn, table):
+    """Every row of table, sorted; sums rounded (summation order differs) and NPI lists sorted."""
+    columns = []
+    for name, type_, *_ in conn.execute(f"DESCRIBE {table}").fetchall():
+        if type_ == "DOUBLE":
+            name = f"ROUND({name}, 2)"
+        elif type_.endswith("[]"):
+            name = f"list_sort({name})"
+        columns.append(name)
+    return conn.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY ALL").fetchall()
+
+
+def test_ingest_matches_a_full_rebuild(built_conn, release):
+    months, changed = ingest.ingest(built_conn, *release, log=None)
+    assert len(months) == 1 and changed == MOVED_NPIS
+
+    # The same raw tables, built from scratch in a second catalog
+    built_conn.execute("ATTACH ':memory:' AS rebuilt")
+    for table in RAW_TABLES:
+        built_conn.execute(f"CREATE TABLE rebuilt.{table} AS SELECT * FROM memory.main.{table}")
+    built_conn.execute("USE rebuilt")
+    build_tables.build_all(built_conn, log=None)
+    expected = {table: _rows(built_conn, table) for table in DERIVED_TABLES}
+    built_conn.execute("USE memory")
+
+    for table in DERIVED_TABLES:
+        assert _rows(built_conn, table) == expected[table], table
+
+
+def test_ingest_invalidates_cached_results(built_conn, release):
+    runner = QueryRunner(built_conn, ResultCache(), version_interval=0)
+    before = runner.submit("hiv_services", states=["CA"]).result()
+    version = dataset_metadata.current_version(built_conn)
+
+    ingest.ingest(built_conn, *release, log=None)
+
+    assert dataset_metadata.current_version(built_conn) != version
+    after = runner.submit("hiv_services", states=["CA"]).result()
+    assert after is not before and not after.equals(before)
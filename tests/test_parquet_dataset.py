@@ -0,0 +1,53 @@
+import duckdb
+import pytest
+
+import parquet_dataset
+from parquet_dataset import ParquetDataset
+
+
+@pytest.fixture
+def conn():
+    """Every exported table, with two state/year cells in the partitioned ones."""
+    conn = duckdb.connect()
+    for table in parquet_dataset.PARTITIONED_TABLES:
+        conn.execute(f"""
+            CREATE TABLE {table} AS
+            SELECT * FROM (VALUES ('CA', 2019, 1), ('CA', 2020, 2), ('NY', 2020, 3)) v(state, year, n)
+        """)
+    for table in parquet_dataset.SINGLE_FILE_TABLES:
+        conn.execute(f"CREATE TABLE {table} AS SELECT 1 AS n")
+    yield conn
+    conn.close()
+
+
+def test_export_round_trips(conn, tmp_path):
+    root = str(tmp_path / "exports" / "tmsis")
+    parquet_dataset.export(conn, root)
+
+    dataset = ParquetDataset(root)
+    exported = dataset.connect()
+    for table in parquet_dataset.PARTITIONED_TABLES + parquet_dataset.SINGLE_FILE_TABLES:
+        expected = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        assert exported.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] == expected
+
+
+def test_scan_reads_only_selected_partitions(conn, tmp_path):
+    root = str(tmp_path)
+    parquet_dataset.export(conn, root)
+
+    dataset = ParquetDataset(root)
+    exported = dataset.connect()
+    table = parquet_dataset.PARTITIONED_TABLES[0]
+    source = dataset.scan(table, {"states": ["CA"], "years": ["2020"]})
+    assert exported.execute(f"SELECT state, year, n FROM {source}").fetchall() == [("CA", 2020, 2)]
+
+
+def test_reexport_drops_stale_partitions(conn, tmp_path):
+    root = tmp_path / "tmsis"
+    parquet_dataset.export(conn, str(root))
+    table = parquet_dataset.PARTITIONED_TABLES[0]
+    conn.execute(f"DELETE FROM {table} WHERE state = 'CA'")
+    parquet_dataset.export(conn, str(root))
+
+    assert [path.name for path in (root / table).iterdir()] == ["state=NY"]
+    assert [path.name for path in tmp_path.iterdir()] == ["tmsis"]
@@ -0,0 +1,20 @@
+import pytest
+
+import arrow_results
+import queries
+
+
+@pytest.mark.parametrize("sort", ["total_hiv_claims", "total_paid", "provider_name"])
+def test_keyset_pages_cover_every_row_once(built_conn, sort):
+    sql, params = queries.render_page("directory_billing", {}, sort=sort)
+    expected = arrow_results.fetch(built_conn, sql, params)["npi"].to_pylist()
+
+    seen, after = [], None
+    while True:
+        sql, params = queries.render_page("directory_billing", {}, sort=sort, after=after, limit=50)
+        page = arrow_results.fetch(built_conn, sql, params)
+        if not page.num_rows:
+            break
+        seen += page["npi"].to_pylist()
+        after = queries.page_cursor("directory_billing", sort, arrow_results.last_row(page))
+    assert seen == expected
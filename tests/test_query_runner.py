@@ -0,0 +1,102 @@
+import itertools
+
+import pytest
+
+import arrow_results
+import dataset_metadata
+import queries
+from query_log import QueryLog
+from query_runner import QueryRunner
+from result_cache import ResultCache
+from result_store import ResultStore
+
+PAGE = dict(after=None, limit=25, search="", category=None, sort="total_hiv_claims", descending=True)
+
+
+@pytest.fixture(params=["memory", "disk"])
+def cache(request, tmp_path):
+    return ResultCache(disk=ResultStore(tmp_path) if request.param == "disk" else None)
+
+
+def test_page_miss_is_fetched_and_cached(built_conn, cache):
+    runner = QueryRunner(built_conn, cache)
+    table = runner.submit_page("directory_billing", {"states": ["CA"]}, **PAGE).result()
+    assert 0 < table.num_rows <= PAGE["limit"]
+
+    # The second request is answered from memory
+    assert runner.submit_page("directory_billing", {"states": ["CA"]}, **PAGE).result() is table
+    assert cache.stats()["hits"] == 1
+
+
+def test_disk_store_serves_a_memory_miss(built_conn, tmp_path):
+    version = dataset_metadata.current_version(built_conn)
+    store = ResultStore(tmp_path)
+    # What warm_cache.py stores: the widened all-states cube
+    store.save(version, queries.cache_key("hiv_services", {}), arrow_results.fetch(built_conn, *queries.render("hiv_services", {})))
+    table = QueryRunner(built_conn, ResultCache()).submit("hiv_services", states=["CA"]).result()
+
+    cold = ResultCache(disk=store)
+    runner = QueryRunner(built_conn, cold)
+    assert sorted(runner.submit("hiv_services", states=["CA"]).result().to_pylist(), key=str) == sorted(table.to_pylist(), key=str)
+    assert cold.stats()["disk_hits"] == 1
+
+
+@pytest.mark.parametrize("template_id, grain, key, providers, truth", [
+    ("state_overview", None, "state", "total_providers", "tmsis_claims"),
+    ("hiv_services", 3, "category", "providers", "hiv_claims_rollup"),
+    ("trends", 3, "year", "providers", "hiv_claims_rollup"),
+])
+def test_narrower_selection_is_rolled_up_from_the_cached_cube(built_conn, template_id, grain, key, providers, truth):
+    cache = ResultCache()
+    runner = QueryRunner(built_conn, cache)
+    runner.submit(template_id).result()
+    table = runner.submit(template_id, states=["CA", "NY"], years=[2019, 2022]).result()
+    assert cache.stats()["misses"] == 1 and cache.stats()["slice_hits"] == 1
+
+    # Provider counts merge across the selected cells exactly
+    if grain is not None:
+        table = arrow_results.grain(table, grain, [key, providers, "total_claims"])
+    column = "hiv_category" if key == "category" else key
+    expected = built_conn.execute(f"""
+        SELECT {column}, COUNT(DISTINCT billing_npi), SUM(total_claims)
+        FROM {truth}
+        WHERE state IN ('CA', 'NY') AND year IN (2019, 2022)
+        GROUP BY 1
+    """).fetchall()
+    assert {row[key]: (row[providers], row["total_claims"]) for row in table.to_pylist()} == {
+        value: (count, float(claims)) for value, count, claims in expected
+    }
+
+
+def test_result_overtaken_by_new_data_is_not_cached(built_conn, monkeypatch):
+    cache = ResultCache()
+    runner = QueryRunner(built_conn, cache)
+    fetch = arrow_results.fetch
+    rebuilds = itertools.count()
+
+    def fetch_during_rebuild(*args):
+        table = fetch(*args)
+        # Another session's version check sees a rebuild while this query runs
+        cache.set_data_version(f"rebuild-{next(rebuilds)}")
+        return table
+
+    monkeypatch.setattr(arrow_results, "fetch", fetch_during_rebuild)
+    assert runner.submit("hcpcs_reference").result().num_rows
+    assert runner.submit_page("directory_billing", {}, **PAGE).result().num_rows
+    monkeypatch.undo()
+
+    assert cache.get("hcpcs_reference", {}) is None
+    assert cache.lookup(queries.page_key("directory_billing", {}, **PAGE)) is None
+    assert cache.stats()["stale_drops"] == 2
+
+
+def test_slow_query_plan_comes_from_its_own_execution(built_conn, tmp_path, monkeypatch):
+    log = QueryLog(tmp_path / "queries.jsonl", slow_ms=0, explain_rate=1)
+    runner = QueryRunner(built_conn, ResultCache(), log=log)
+    executions = []
+    fetch = arrow_results.fetch
+    monkeypatch.setattr(arrow_results, "fetch", lambda *args: executions.append(args) or fetch(*args))
+
+    runner.submit("state_overview").result()
+    assert sum("state_year_summary" in sql for _, sql, *_ in executions) == 1
+    assert "state_year_summary" in log.plans()["plan"][0].as_py()
@@ -0,0 +1,43 @@
+import pytest
+
+import dataset_metadata
+from working_set import WorkingSet
+
+
+class UnreachableWarehouse:
+    def cursor(self):
+        raise RuntimeError("connection reset")
+
+
+def test_hydrated_copy_serves_the_current_version(built_conn):
+    version = dataset_metadata.current_version(built_conn)
+    working_set = WorkingSet(built_conn, directory=None, log=None)
+    working_set._hydrate(version)
+
+    assert working_set.serves("hiv_services", version)
+    with working_set.cursor() as cursor:
+        rows = cursor.execute("SELECT COUNT(*) FROM hiv_claims_rollup").fetchone()[0]
+    assert rows == built_conn.execute("SELECT COUNT(*) FROM hiv_claims_rollup").fetchone()[0]
+
+
+def test_failed_hydration_can_be_retried():
+    working_set = WorkingSet(UnreachableWarehouse(), directory=None, log=None)
+    working_set._hydrating = "v1"
+    with pytest.raises(RuntimeError):
+        working_set._hydrate("v1")
+    assert working_set._hydrating is None
+    assert not working_set.serves("hiv_services", "v1")
+
+
+def test_processes_share_the_working_set_directory(built_conn, tmp_path):
+    version = dataset_metadata.current_version(built_conn)
+    first = WorkingSet(built_conn, directory=tmp_path, log=None)
+    first._hydrate(version)
+
+    # A second process finds the finished copy, and rehydrating reuses it instead of the warehouse
+    second = WorkingSet(UnreachableWarehouse(), directory=tmp_path, log=None)
+    assert second.serves("trends", version)
+    second._hydrate(version)
+    with second.cursor() as cursor:
+        assert cursor.execute("SELECT data_version FROM working_set_version").fetchone()[0] == version
+    assert [path.name for path in tmp_path.iterdir()] == [f"hiv-{version}.duckdb"]
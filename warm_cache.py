@@ -0,0 +1,108 @@
+"""
+Precompute the most common page results into the persistent result store
+(result_store.py) so the first sessions after a deploy or restart don't pay
+for them.
+
+For the current data version it runs every page query for all states and
+each single state (with --years, also each year and each state-year) and
+the first Provider Directory page of every view in its default sort.
+Filters on a template's dimensions are widened first, exactly as
+QueryRunner does, so e.g. one State Overview cube serves every state and
+year selection and is stored once; --years then only adds directory pages.
+Results of older data versions are deleted afterwards.
+
+Run after build_tables.py and before traffic arrives:
+
+    MOTHERDUCK_TOKEN=... python warm_cache.py
+    TMSIS_BACKEND=duckdb TMSIS_DATABASE=tmsis.duckdb python warm_cache.py --years
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import arrow_results
+import backends
+import dataset_metadata
+import queries
+from result_store import STORE_ROOT, ResultStore
+
+# Template queries each page issues; hcpcs_reference takes no filters
+PAGE_TEMPLATES = ["state_overview", "hiv_services", "trends"]
+DIRECTORY_TEMPLATES = ["directory_billing", "directory_servicing", "directory_combined"]
+DIRECTORY_PAGE_SIZE = 100  # the directory's default "Rows per page"
+
+
+def filter_grid(states, years, with_years=False):
+    """All states, each state and optionally each year and state-year."""
+    grid = [{}] + [{"states": [state]} for state in states]
+    if with_years:
+        grid += [{"years": [year]} for year in years]
+        grid += [{"states": [state], "years": [year]} for state in states for year in years]
+    return grid
+
+
+def jobs(grid, table_source=None):
+    """(key, sql, params) for every distinct result the grid's page loads need."""
+    seen = set()
+
+    def add(key, sql, params):
+        if key not in seen:
+            seen.add(key)
+            yield key, sql, params
+
+    yield from add(queries.cache_key("hcpcs_reference", {}), *queries.render("hcpcs_reference", {}, table_source))
+    for filters in grid:
+        for template_id in PAGE_TEMPLATES:
+            wide = queries.normalize_filters(queries.widen(template_id, filters))
+            yield from add(queries.cache_key(template_id, wide), *queries.render(template_id, wide, table_source))
+        for template_id in DIRECTORY_TEMPLATES:
+            # The options the directory page requests before anything is changed
+            page = dict(after=None, limit=DIRECTORY_PAGE_SIZE, search="", category=None,
+                        sort=next(iter(queries.TEMPLATES[template_id].sort_columns)), descending=True)
+            key = queries.page_key(template_id, queries.normalize_filters(filters), **page)
+            yield from add(key, *queries.render_page(template_id, filters, table_source=table_source, **page))
+
+
+def warm(conn, store, grid, table_source=None, workers=4):
+    version = dataset_metadata.current_version(conn)
+
+    def run(job):
+        key, sql, params = job
+        if store.load(version, key) is not None:
+            return key, None  # already warmed for this version
+        with conn.cursor() as cursor:
+            start = time.perf_counter()
+            table = arrow_results.fetch(cursor, sql, params)
+            store.save(version, key, table)
+            return key, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for key, elapsed in pool.map(run, jobs(grid, table_source)):
+            print(f"  {key[0]:28} {'already stored' if elapsed is None else f'{elapsed:.1f}s'}")
+    return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute common page results into the persistent result store.")
+    parser.add_argument("--store", default=str(STORE_ROOT), help=f"Result store root (default: {STORE_ROOT})")
+    parser.add_argument("--years", action="store_true", help="Also warm each year and each state-year")
+    parser.add_argument("--workers", type=int, default=4, help="Queries run at once")
+    parser.add_argument("--keep-old", action="store_true", help="Keep results of older data versions")
+    args = parser.parse_args()
+
+    backend = backends.from_env()
+    conn = backend.connect()
+    meta = dataset_metadata.fetch(conn)
+    store = ResultStore(args.store)
+
+    start = time.time()
+    version = warm(conn, store, filter_grid(meta["states"], meta["years"], args.years),
+                   table_source=backend.table_source, workers=args.workers)
+    print(f"warmed data version {version} in {time.time() - start:.1f}s")
+    if not args.keep_old:
+        for old in store.prune(version):
+            print(f"removed results for data version {old}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Local in-process copy of the HIV working set, hydrated from the warehouse.
+
+HIV-coded claims are a small slice of tmsis_claims, and every page except
+State Overview reads only hiv_claims_rollup, provider_dim and
+hiv_hcpcs_reference. WorkingSet streams the rollup, the reference and the
+provider_dim rows of NPIs the rollup mentions into a local DuckDB database
+as Arrow record batches. QueryRunner then runs LOCAL_TEMPLATES there, with
+no network round trip, and sends the rest to the warehouse.
+
+The copy is tagged with the data_version it was taken at and only serves
+queries while that is the version QueryRunner last saw. refresh() with a
+new version rehydrates in a background thread into a fresh database and
+swaps it in when complete, so queries go to the warehouse meanwhile.
+
+By default the copy lives in memory. With TMSIS_WORKING_SET set to a
+directory it is kept there as hiv-<version>.duckdb, so a restart serves
+the last copy at once, even before the warehouse answers, and only
+rehydrates when the data has changed. App processes may share the
+directory: each hydrates into its own scratch file and moves it into place
+once complete, and every process opens the finished copy read-only.
+"""
+import os
+import threading
+import time
+from pathlib import Path
+
+import duckdb
+
+import build_tables
+
+WORKING_SET_DIR = os.environ.get("TMSIS_WORKING_SET")  # None keeps the copy in memory
+
+# Templates whose tables are all in the working set
+LOCAL_TEMPLATES = frozenset({
+    "hcpcs_reference", "hiv_services", "trends",
+    "directory_billing", "directory_servicing", "directory_combined",
+})
+
+# Local table -> warehouse query that fills it, sorted like the warehouse copy
+HYDRATE_QUERIES = {
+    "hiv_hcpcs_reference": "SELECT * FROM hiv_hcpcs_reference",
+    "hiv_claims_rollup": "SELECT * FROM hiv_claims_rollup ORDER BY state, claim_month",
+    "provider_dim": """
+        SELECT * FROM provider_dim
+        WHERE npi IN (
+            SELECT billing_npi FROM hiv_claims_rollup
+            UNION
+            SELECT servicing_npi FROM hiv_claims_rollup
+        )
+        ORDER BY npi
+    """,
+}
+
+BATCH_ROWS = 1_000_000
+
+
+class WorkingSet:
+    def __init__(self, remote, directory=WORKING_SET_DIR, log=print):
+        self.remote = remote
+        self.directory = Path(directory) if directory else None
+        self.log = log
+        self.version = None
+        self._conn = None
+        self._hydrating = None  # version being hydrated in the background
+        self._lock = threading.Lock()
+        if self.directory:
+            self._open_latest()
+
+    def serves(self, template_id, version):
+        """True if template_id can run locally for the warehouse's data version (None: unknown)."""
+        return (
+            template_id in LOCAL_TEMPLATES and self._conn is not None
+            and (version is None or version == self.version)
+        )
+
+    def cursor(self):
+        with self._lock:
+            return self._conn.cursor()
+
+    def refresh(self, version):
+        """Start rehydrating in the background unless version is already local or on its way."""
+        with self._lock:
+            if version in (self.version, self._hydrating):
+                return
+            self._hydrating = version
+        threading.Thread(target=self._hydrate, args=(version,), name="working-set", daemon=True).start()
+
+    def _path(self, version):
+        return self.directory / f"hiv-{version}.duckdb"
+
+    def _open_latest(self):
+        files = sorted(self.directory.glob("hiv-*.duckdb"), key=lambda path: path.stat().st_mtime)
+        if not files:
+            return
+        try:
+            conn = duckdb.connect(str(files[-1]), read_only=True)
+            self.version = conn.execute("SELECT data_version FROM working_set_version").fetchone()[0]
+            self._conn = conn
+        except duckdb.Error as exc:
+            # Copies are only moved into place complete, so this is e.g. a file from an
+            # incompatible DuckDB version; the next refresh() hydrates a new one
+            self._log(f"working set: can't open {files[-1]}, waiting for a refresh ({exc})")
+
+    def _hydrate(self, version):
+        try:
+            self._hydrate_copy(version)
+        finally:
+            # Whatever happened, a later refresh() may try this version again
+            with self._lock:
+                if self._hydrating == version:
+                    self._hydrating = None
+
+    def _hydrate_copy(self, version):
+        start = time.perf_counter()
+        path = self._path(version) if self.directory else None
+        # Per-process name, so processes sharing the directory never write the same file
+        scratch = path.with_name(f"{path.name}.{os.getpid()}.tmp") if path else None
+        try:
+            if path is None:
+                local = duckdb.connect(":memory:")
+                self._copy_tables(local, version)
+            else:
+                # Another process sharing the directory may have hydrated this version already
+                if not path.exists():
+                    self.directory.mkdir(parents=True, exist_ok=True)
+                    scratch.unlink(missing_ok=True)
+                    with duckdb.connect(str(scratch)) as building:
+                        self._copy_tables(building, version)
+                    os.replace(scratch, path)
+                local = duckdb.connect(str(path), read_only=True)
+        except (duckdb.Error, OSError) as exc:
+            if scratch:
+                scratch.unlink(missing_ok=True)
+            self._log(f"working set: hydrating {version} failed, HIV pages stay on the warehouse ({exc})")
+            return
+
+        with self._lock:
+            # Queries already running keep their cursors on the old copy
+            self._conn, self.version = local, version
+        rows = local.execute("SELECT COUNT(*) FROM hiv_claims_rollup").fetchone()[0]
+        self._log(f"working set: {rows:,} rollup rows for data version {version} in {time.perf_counter() - start:.1f}s")
+        if self.directory:
+            for old in self.directory.glob("hiv-*.duckdb"):
+                if old != path:
+                    try:
+                        old.unlink()
+                    except OSError:
+                        pass  # still open on a platform that locks open files
+
+    def _copy_tables(self, local, version):
+        with self.remote.cursor() as cursor:
+            for table, sql in HYDRATE_QUERIES.items():
+                local.register("incoming", cursor.execute(sql).to_arrow_reader(BATCH_ROWS))
+                local.execute(f"CREATE TABLE {table} AS SELECT * FROM incoming")
+                local.unregister("incoming")
+        build_tables.build_search_index(local, log=self.log)
+        local.execute("CREATE TABLE working_set_version AS SELECT $version AS data_version", {"version": version})
+
+    def _log(self, message):
+        if self.log:
+            self.log(message)